@@ -0,0 +1,308 @@
+"""
+Benchmarks of the hot paths, using synthetic seeded inputs
+Results are saved as JSON and can be compared against an earlier run.
+No display is required
+"""
+
+import os
+# Pygame must not open a window, set before render or camera import it
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import extrapolate
+import path_gen
+import render
+import expansion
+from camera import Camera
+from path_tool import PathCreate
+
+import argparse
+import contextlib
+import io
+from functools import partial
+import json
+import math
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pygame
+from PIL import Image
+
+SEED = 1
+REPEATS = 5
+# The relative slowdown of the median time that counts as a regression
+THRESHOLD = 0.1
+
+IMAGE_SIZE = 256
+# The rows of the synthetic trace image are this many pixels apart
+CORRIDOR_SPACING = 4
+PATH_POINTS = 20000
+PATH_REVOLUTIONS = 8
+COEFFICIENT_SETTINGS = [(100, 1000), (1000, 1000), (1000, 10000)]
+FRAME_TERMS = 1000
+FRAMES = 60
+
+
+def synthetic_image(file_path, size, seed=SEED):
+    """Saves a square trace image of 'size' pixels to 'file_path'
+    The path is a serpentine of corridors, each joined to the next at a
+    random column, from a start pixel at the top to an end at the bottom
+    """
+    random = np.random.default_rng(seed)
+    pixels = np.full((size, size, 3), path_gen.BLANK_COLOR, dtype=np.uint8)
+
+    rows = range(1, size-1, CORRIDOR_SPACING)
+    for row in rows:
+        pixels[row, 1:size-1] = (0, 0, 0)
+    for row in rows[:-1]:
+        column = random.integers(1, size-1)
+        pixels[row:row+CORRIDOR_SPACING, column] = (0, 0, 0)
+
+    pixels[rows[0], 1] = path_gen.START_COLOR
+    pixels[rows[-1], size-2] = path_gen.END_COLOR
+    Image.fromarray(pixels).save(file_path)
+
+
+def synthetic_points(count, revolutions, seed=SEED):
+    """Returns an array of 'count' complex points, which circle the origin
+    'revolutions' times with a random radius that varies smoothly
+    """
+    random = np.random.default_rng(seed)
+    angles = np.linspace(0, 2*math.pi*revolutions, count, endpoint=False)
+
+    radius = np.ones(count)
+    for harmonic in range(1, 8):
+        amplitude = random.uniform(0, 0.3/harmonic)
+        offset = random.uniform(0, 2*math.pi)
+        radius += amplitude * np.sin(harmonic*angles/revolutions + offset)
+    return radius * np.exp(1j*angles)
+
+
+def synthetic_path(count=PATH_POINTS, revolutions=PATH_REVOLUTIONS, seed=SEED):
+    """Returns a synthetic path as a pair of arrays (angles, values)
+    """
+    path_creator = PathCreate()
+    path_creator.add_points(synthetic_points(count, revolutions, seed))
+    return tuple(array.copy() for array in path_creator.path)
+
+
+def quiet(function, *args):
+    """Calls 'function', discarding anything it prints to stdout
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def time_case(setup, run, repeats=REPEATS):
+    """Returns a list of the seconds taken by 'repeats' calls of 'run'
+    'setup' is called before each, it returns the arguments of 'run'
+    """
+    times = []
+    for _ in range(repeats):
+        args = setup()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def gen_cases(directory, image_size=IMAGE_SIZE, seed=SEED):
+    """Yields tuples of (name, setup, run) for every benchmark
+    Inputs are generated in 'directory'
+    """
+    image_path = os.path.join(directory, "synthetic.png")
+    synthetic_image(image_path, image_size, seed)
+
+    def image_data():
+        return (quiet(path_gen.get_image_data, image_path),)
+
+    def filled_data():
+        data = image_data()[0]
+        path_gen.fill_image_data(data)
+        return (data,)
+
+    yield "path_gen.get_image_data", tuple, image_data
+    yield "path_gen.fill_image_data", image_data, path_gen.fill_image_data
+    yield "path_gen.shortest_path", filled_data, path_gen.shortest_path
+
+    points = synthetic_points(PATH_POINTS, PATH_REVOLUTIONS, seed)
+
+    def add_point(points):
+        path_creator = PathCreate()
+        for point in points.tolist():
+            path_creator.add_point(point)
+
+    def add_points(points):
+        PathCreate().add_points(points)
+
+    yield "PathCreate.add_point", lambda: (points,), add_point
+    yield "PathCreate.add_points", lambda: (points,), add_points
+
+    path = synthetic_path(PATH_POINTS, PATH_REVOLUTIONS, seed)
+    phases = np.random.default_rng(seed).uniform(0, path[0][-1], PATH_POINTS)
+
+    def extrapolate_scalar(path_function):
+        for phase in phases.tolist():
+            path_function(phase)
+
+    yield "extrapolate.linear_extrapolater", lambda: (path,), (
+        extrapolate.linear_extrapolater
+    )
+    yield "linear_extrapolater(scalar)", (
+        lambda: (extrapolate.linear_extrapolater(path),)
+    ), extrapolate_scalar
+    yield "linear_extrapolater(array)", (
+        lambda: (extrapolate.linear_extrapolater(path), phases)
+    ), lambda path_function, phases: path_function(phases)
+
+    for n, steps in COEFFICIENT_SETTINGS:
+        yield f"path_coefficients(n={n}, steps={steps})", tuple, (
+            lambda n=n, steps=steps: expansion.path_coefficients(
+                path, n, steps=steps, use_cache=False
+            )
+        )
+    yield f"path_coefficients(n={FRAME_TERMS}, exact)", tuple, (
+        lambda: expansion.path_coefficients(
+            path, FRAME_TERMS, exact=True, use_cache=False
+        )
+    )
+
+    series = expansion.path_coefficients(path, FRAME_TERMS, use_cache=False)
+    times = [index/FRAMES for index in range(FRAMES)]
+
+    def accumulate_frames(radial_accumulation):
+        for t in times:
+            radial_accumulation(t)
+
+    yield f"radial_accumulation(series, {FRAMES} frames)", (
+        lambda: (expansion.gen_series_accumulation(*series),)
+    ), accumulate_frames
+    yield f"radial_accumulation(stepped, {FRAMES} frames)", (
+        lambda: (expansion.gen_stepped_accumulation(*series),)
+    ), accumulate_frames
+
+    radial_accumulation = expansion.gen_series_accumulation(*series)
+    accumulations = [radial_accumulation(t) for t in times]
+
+    def focal_points():
+        for accumulation in accumulations:
+            expansion.get_focal_points(accumulation)
+
+    yield f"get_focal_points({FRAMES} frames)", tuple, focal_points
+
+    surface = pygame.Surface((render.RENDER_RADIUS*2, render.RENDER_RADIUS*2))
+
+    def flush_frames():
+        camera = Camera(surface, render.RENDER_RADIUS, 2)
+        draw_pendulum = render.gen_draw_pendulum(
+            FRAMES, partial(next, iter(times))
+        )
+        for accumulation in accumulations:
+            draw_pendulum(camera, accumulation, 0)
+            camera.flush()
+
+    yield f"draw_pendulum+Camera.flush({FRAMES} frames)", tuple, flush_frames
+
+
+def run_benchmarks(repeats=REPEATS, image_size=IMAGE_SIZE, seed=SEED,
+                   select=None):
+    """Returns a dictionary of the benchmark results and run settings
+    Only benchmarks with a name containing 'select' are run, if given
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, setup, run in gen_cases(directory, image_size, seed):
+            if select is not None and select not in name:
+                continue
+
+            times = time_case(setup, run, repeats)
+            results[name] = {
+                "median": statistics.median(times),
+                "min": min(times),
+                "times": times,
+            }
+            print(
+                f"{name:<45} {results[name]['median']*1000:10.3f} ms",
+                file=sys.stderr
+            )
+
+    return {
+        "settings": {
+            "repeats": repeats,
+            "image_size": image_size,
+            "seed": seed,
+        },
+        "platform": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """Prints the change in median time of each benchmark in both runs
+    Returns a list of the names of benchmarks slower by over 'threshold'
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+
+        before, after = baseline["results"][name]["median"], result["median"]
+        change = after/before - 1 if before else 0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "REGRESSION"
+        print(
+            f"{name:<45} {before*1000:10.3f} ms {after*1000:10.3f} ms "
+            f"{change:+8.1%} {flag}"
+        )
+
+    if baseline["settings"] != current["settings"]:
+        print("Warning: the runs used different settings", file=sys.stderr)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--output", metavar="FILE", help="save the results as JSON to FILE"
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE",
+        help="compare against the JSON results in FILE, exits with status 1 "
+             "if any benchmark regressed"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=THRESHOLD,
+        help=f"the relative slowdown counted as a regression "
+             f"(default: {THRESHOLD})"
+    )
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--image-size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument(
+        "--select", metavar="NAME",
+        help="only run benchmarks with a name containing NAME"
+    )
+    args = parser.parse_args()
+
+    current = run_benchmarks(
+        args.repeats, args.image_size, args.seed, args.select
+    )
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(current, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(baseline, current, args.threshold):
+            sys.exit(1)
@@ -0,0 +1,141 @@
+"""
+A persistent on-disk cache of fourier coefficients
+Entries are keyed by the content of the path and the integration settings
+"""
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+import extrapolate
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME")
+    or os.path.join(os.path.expanduser("~"), ".cache"),
+    "fouriertrace"
+)
+# The total size of the cache before old entries are evicted
+CACHE_SIZE = 256 * (1 << 20)
+
+SUFFIX = ".npy"
+
+
+def path_key(points, period, n, **settings):
+    """Returns a hex digest identifying the coefficients of a path.
+    'points' is a path, as accepted by extrapolate.path_arrays()
+    'settings' are any other parameters that change the coefficients
+    """
+    angles, values = extrapolate.path_arrays(points)
+
+    digest = hashlib.sha256()
+    digest.update(angles.tobytes())
+    digest.update(values.tobytes())
+    digest.update(repr((period, n, sorted(settings.items()))).encode())
+    return digest.hexdigest()
+
+
+def entry_path(key, directory=CACHE_DIR):
+    """Returns the file path of the cache entry 'key'
+    """
+    return os.path.join(directory, key + SUFFIX)
+
+
+def entries(directory=CACHE_DIR):
+    """Returns a list of tuples (last_used, size, file_path)
+    Each represents an entry in the cache, the oldest comes first
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+
+    found = []
+    for name in names:
+        if not name.endswith(SUFFIX):
+            continue
+        file_path = os.path.join(directory, name)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            # Removed by another process
+            continue
+        found.append((stat.st_mtime, stat.st_size, file_path))
+    return sorted(found)
+
+
+def load(key, directory=CACHE_DIR):
+    """Returns the cached coefficient array for 'key' or None on a miss
+    """
+    file_path = entry_path(key, directory)
+    try:
+        coefficients = np.load(file_path, allow_pickle=False)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+
+    # Mark as recently used, the cache may be read only
+    try:
+        os.utime(file_path)
+    except OSError:
+        pass
+    return coefficients
+
+
+def evict(directory=CACHE_DIR, max_size=CACHE_SIZE):
+    """Removes the least recently used entries until the cache fits 'max_size'
+    """
+    cached = entries(directory)
+    total = sum(size for _, size, _ in cached)
+    for _, size, file_path in cached:
+        if total <= max_size:
+            break
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def store(key, coefficients, directory=CACHE_DIR, max_size=CACHE_SIZE):
+    """Saves the coefficient array for 'key' then evicts old entries
+    The cache is best-effort, if it cannot be written a warning is printed
+    """
+    file_path = entry_path(key, directory)
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+
+        # Write then rename so readers never see a partial entry
+        with open(temp_path, 'wb') as file:
+            np.save(file, np.asarray(coefficients, dtype=np.complex128))
+        os.replace(temp_path, file_path)
+
+        evict(directory, max_size)
+    except OSError as error:
+        print(f"Could not write to the cache: {error}", file=sys.stderr)
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def clear(directory=CACHE_DIR):
+    """Removes every entry in the cache
+    """
+    for _, _, file_path in entries(directory):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+
+def cached_coefficients(compute, key, directory=CACHE_DIR, max_size=CACHE_SIZE):
+    """Returns the coefficient array for 'key', loading it from the cache.
+    On a miss, 'compute' is called with no arguments and its result stored
+    """
+    coefficients = load(key, directory)
+    if coefficients is None:
+        coefficients = compute()
+        store(key, coefficients, directory, max_size)
+    return coefficients
@@ -1,5 +1,19 @@
-import pygame
-from pygame import gfxdraw # noqa
+"""
+A camera that draws shapes in world space onto a pygame surface
+Pygame is only imported once shapes are drawn
+"""
+
+import numpy as np
+
+# Pygame cannot render shapes with coordinates outside of this range
+SCREEN_LIMIT = (1 << 15) - 1
+
+# Circles with a smaller radius in pixels are not drawn
+CULL_PIXELS = 1
+# Runs of shorter chain segments are merged into a single segment
+LOD_PIXELS = 2
+# The longest run of merged segments, in pixels
+LOD_RUN_PIXELS = 4*LOD_PIXELS
 
 
 class Shape():
@@ -14,11 +28,13 @@ class Circle(Shape):
         self.radius = radius
 
     def draw(self, cam):
+        from pygame import gfxdraw
+
         c = cam.point_on_surface(cam.get_local(self.center))
         r = int(self.radius/cam.radius * cam._RENDER_RADIUS)
 
         try:
-            pygame.gfxdraw.circle(cam._surface, *c, r, self.color)
+            gfxdraw.circle(cam._surface, *c, r, self.color)
         except OverflowError:
             # Pygame cannot render shapes outside of screen
             pass
@@ -31,16 +47,113 @@ class Line(Shape):
         self.p2 = p2
 
     def draw(self, cam):
+        from pygame import gfxdraw
+
         local1, local2 = cam.get_local(self.p1), cam.get_local(self.p2)
         p1, p2 = cam.point_on_surface(local1), cam.point_on_surface(local2)
 
         try:
-            pygame.gfxdraw.line(cam._surface, *p1, *p2, self.color)
+            gfxdraw.line(cam._surface, *p1, *p2, self.color)
         except OverflowError:
             # Pygame cannot render shapes outside of screen
             pass
 
 
+class Polyline(Shape):
+    """A chain of connected lines through the complex array 'points'
+    'runs' is the index of the first segment of each run of segments,
+    'colors' holds the color of each run
+    """
+    def __init__(self, colors, points, runs=(0,)):
+        self.colors = colors
+        self.points = np.asarray(points, dtype=np.complex128)
+        self.runs = np.asarray(runs, dtype=np.int64)
+
+    def draw(self, cam):
+        import pygame
+
+        coord = (cam.get_local(self.points)+1+1j) * cam._RENDER_RADIUS
+        width, height = cam._surface.get_size()
+        starts, ends, visible = clip_segments(
+            coord[:-1], coord[1:], complex(width, height)
+        )
+
+        # The chain is also split where a segment leaves the view, each
+        # part is drawn with a single call
+        breaks = np.zeros(len(visible)+1, dtype=bool)
+        breaks[[0, -1]] = True
+        breaks[self.runs] = True
+        breaks[1:-1] |= ~(
+            visible[:-1] & visible[1:] & (ends[:-1] == starts[1:])
+        )
+        bounds = np.flatnonzero(breaks)
+
+        run = np.searchsorted(self.runs, bounds[:-1], side='right') - 1
+        for first, last, color in zip(
+            bounds[:-1].tolist(), bounds[1:].tolist(), run.tolist()
+        ):
+            if not visible[first]:
+                continue
+            part = np.append(starts[first:last], ends[last-1])
+            part = np.column_stack((part.real, part.imag)).astype(np.int64)
+            pygame.draw.lines(
+                cam._surface, self.colors[color], False, part.tolist()
+            )
+
+
+def clip_segments(starts, ends, size):
+    """Clips the segments between the complex arrays 'starts' and 'ends' to
+    the rectangle from 0 to the complex 'size' (Liang-Barsky).
+    Returns the clipped (starts, ends) and a mask of the visible segments
+    """
+    def inside(points):
+        return (
+            (points.real >= 0) & (points.real <= size.real)
+            & (points.imag >= 0) & (points.imag <= size.imag)
+        )
+
+    # Most segments are entirely in view and need no clipping
+    clip = np.flatnonzero(~(inside(starts) & inside(ends)))
+    visible = np.ones(len(starts), dtype=bool)
+    if len(clip) == 0:
+        return starts, ends, visible
+
+    start, delta = starts[clip], ends[clip] - starts[clip]
+    low, high = np.zeros(len(clip)), np.ones(len(clip))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in (
+            (-delta.real, start.real), (delta.real, size.real-start.real),
+            (-delta.imag, start.imag), (delta.imag, size.imag-start.imag),
+        ):
+            ratio = q / p
+            low = np.where(p < 0, np.maximum(low, ratio), low)
+            high = np.where(p > 0, np.minimum(high, ratio), high)
+            visible[clip] &= ~((p == 0) & (q < 0))
+    visible[clip] &= low <= high
+
+    starts, ends = starts.copy(), ends.copy()
+    starts[clip], ends[clip] = start + low*delta, start + high*delta
+    return starts, ends, visible
+
+
+def as_colors(colors, count):
+    """Returns a (count, 4) array of RGBA colors
+    'colors' is either a single color tuple or a sequence of color tuples
+    """
+    colors = np.asarray(colors, dtype=np.uint8)
+    if colors.ndim == 1:
+        colors = np.broadcast_to(colors, (count, len(colors)))
+    if colors.shape[1] == 3:
+        colors = np.column_stack((colors, np.full(count, 255, np.uint8)))
+    return colors
+
+
+def as_zindex(zindex, count):
+    """Returns an array of 'count' z-indexes from a scalar or sequence
+    """
+    return np.broadcast_to(np.asarray(zindex, dtype=np.float64), (count,))
+
+
 class Camera():
     def __init__(self, surface, render_radius, radius=1):
         self._RENDER_RADIUS = render_radius
@@ -52,7 +165,13 @@ class Camera():
         self._target_radius = radius
         self._animate_speed = 10
 
+        self.cull_pixels = CULL_PIXELS
+        self.lod_pixels = LOD_PIXELS
+        self.lod_run_pixels = LOD_RUN_PIXELS
+
         self.draw_buffer = []
+        self._circle_batches = []
+        self._line_batches = []
 
     def get_local(self, point):
         return (point - self.center)/self.radius
@@ -61,16 +180,184 @@ class Camera():
         coord = ((point+1+1j) * self._RENDER_RADIUS)
         return int(coord.real), int(coord.imag)
 
+    def points_on_surface(self, points):
+        """Returns a pair of integer arrays (x, y) of screen coordinates
+        This is the vectorised equivalent of point_on_surface(get_local(p))
+        """
+        local = (np.asarray(points) - self.center)/self.radius
+        coord = (local+1+1j) * self._RENDER_RADIUS
+        return (
+            np.trunc(coord.real).astype(np.int64),
+            np.trunc(coord.imag).astype(np.int64)
+        )
+
+    def pixel_scale(self):
+        """Returns the number of pixels per unit length in world space
+        """
+        return self._RENDER_RADIUS/self.radius
+
+    def chain_joints(self, points, keep=()):
+        """Returns an index array of the joints of a chain of segments to draw
+        Runs of segments shorter than 'lod_pixels' are merged into a single
+        segment no longer than 'lod_run_pixels'. Indexes in 'keep' are kept
+        """
+        lengths = np.abs(np.diff(points)) * self.pixel_scale()
+        small = lengths < self.lod_pixels
+
+        # Split long runs so the merged segment stays close to the chain
+        distance = np.concatenate(([0], np.cumsum(lengths)))
+        run = np.floor(distance / self.lod_run_pixels)
+
+        joints = np.ones(len(points), dtype=bool)
+        joints[1:-1] = ~(small[:-1] & small[1:]) | (run[1:-1] != run[:-2])
+        joints[[k for k in keep if 0 <= k < len(points)]] = True
+        return np.flatnonzero(joints)
+
     def animate_radius(self, target):
         self._target_radius = target
 
     def add_shape(self, shape, zindex=0):
-        self.draw_buffer.append((zindex, shape))
+        if isinstance(shape, Circle):
+            self.add_circles(shape.color, [shape.center], [shape.radius], zindex)
+        elif isinstance(shape, Line):
+            self.add_lines(shape.color, [shape.p1], [shape.p2], zindex)
+        else:
+            self.draw_buffer.append((zindex, shape))
+
+    def add_circles(self, colors, centers, radii, zindex=0):
+        """Queues a batch of circles, the arguments are arrays of equal length
+        'colors' and 'zindex' may also be a single value for the whole batch
+        """
+        centers = np.asarray(centers, dtype=np.complex128)
+        self._circle_batches.append((
+            as_zindex(zindex, len(centers)),
+            as_colors(colors, len(centers)),
+            centers,
+            np.asarray(radii, dtype=np.float64)
+        ))
+
+    def add_lines(self, colors, starts, ends, zindex=0):
+        """Queues a batch of lines, the arguments are arrays of equal length
+        'colors' and 'zindex' may also be a single value for the whole batch
+        """
+        starts = np.asarray(starts, dtype=np.complex128)
+        self._line_batches.append((
+            as_zindex(zindex, len(starts)),
+            as_colors(colors, len(starts)),
+            starts,
+            np.asarray(ends, dtype=np.complex128)
+        ))
 
     def tick(self, dt):
         self.radius += (self._target_radius-self.radius)*dt*self._animate_speed
 
+    def _screen_circles(self):
+        """Returns the queued circles as (zindex, colors, coordinates)
+        Each row of coordinates is an (x, y, radius) screen triple
+        """
+        zindex, colors, centers, radii = map(
+            np.concatenate, zip(*self._circle_batches)
+        )
+        # Cull circles that are too small or have no outline in view
+        local = (centers - self.center)/self.radius
+        local_radii = radii/self.radius
+        outside = np.maximum(np.abs(local.real)-1, 0) + 1j*np.maximum(
+            np.abs(local.imag)-1, 0
+        )
+        furthest = np.abs(local.real)+1 + 1j*(np.abs(local.imag)+1)
+        visible = (
+            (local_radii*self._RENDER_RADIUS >= self.cull_pixels)
+            & (np.abs(outside) <= local_radii)
+            & (local_radii <= np.abs(furthest))
+        )
+
+        x, y = self.points_on_surface(centers[visible])
+        r = np.trunc(radii[visible]*self.pixel_scale()).astype(np.int64)
+        return zindex[visible], colors[visible], np.column_stack((x, y, r))
+
+    def _screen_lines(self):
+        """Returns the queued lines as (zindex, colors, coordinates)
+        Each row of coordinates is an (x1, y1, x2, y2) screen quadruple
+        """
+        zindex, colors, starts, ends = map(
+            np.concatenate, zip(*self._line_batches)
+        )
+        # Cull lines with a bounding box outside of the view
+        local1 = (starts - self.center)/self.radius
+        local2 = (ends - self.center)/self.radius
+        visible = (
+            (np.minimum(local1.real, local2.real) <= 1)
+            & (np.maximum(local1.real, local2.real) >= -1)
+            & (np.minimum(local1.imag, local2.imag) <= 1)
+            & (np.maximum(local1.imag, local2.imag) >= -1)
+        )
+
+        x1, y1 = self.points_on_surface(starts[visible])
+        x2, y2 = self.points_on_surface(ends[visible])
+        return zindex[visible], colors[visible], np.column_stack(
+            (x1, y1, x2, y2)
+        )
+
     def flush(self):
-        self.draw_buffer.sort(key=lambda i: i[0])
-        while self.draw_buffer:
-            self.draw_buffer.pop()[1].draw(self)
+        """Draws every queued shape, the highest zindex is drawn first
+        Shapes of equal zindex are drawn grouped by color
+        Returns the number of shapes left to draw after culling
+        """
+        import pygame
+        from pygame import gfxdraw
+
+        batches = []
+        if self._circle_batches:
+            batches.append((gfxdraw.circle, *self._screen_circles()))
+        if self._line_batches:
+            batches.append((gfxdraw.line, *self._screen_lines()))
+        self._circle_batches, self._line_batches = [], []
+
+        # Flatten every batch into a single draw order
+        kinds = np.concatenate([
+            np.full(len(batch[1]), kind) for kind, batch in enumerate(batches)
+        ] + [np.full(len(self.draw_buffer), len(batches))])
+        zindex = np.concatenate(
+            [batch[1] for batch in batches]
+            + [np.array([z for z, _ in self.draw_buffer], dtype=np.float64)]
+        )
+        colors = np.concatenate(
+            [batch[2] for batch in batches]
+            + [np.zeros((len(self.draw_buffer), 4), np.uint8)]
+        )
+        rows = np.concatenate(
+            [np.arange(len(batch[1])) for batch in batches]
+            + [np.arange(len(self.draw_buffer))]
+        )
+
+        # The last key is the primary sort key
+        order = np.lexsort((
+            rows, colors[:, 3], colors[:, 2], colors[:, 1], colors[:, 0],
+            kinds, -zindex
+        ))
+
+        on_screen = [
+            np.all(np.abs(batch[3]) <= SCREEN_LIMIT, axis=1).tolist()
+            for batch in batches
+        ]
+        coordinates = [batch[3].tolist() for batch in batches]
+        draw_functions = [batch[0] for batch in batches]
+
+        color, last_color = None, None
+        for kind, row, rgba in zip(
+            kinds[order].tolist(), rows[order].tolist(),
+            map(tuple, colors[order].tolist())
+        ):
+            if kind == len(batches):
+                self.draw_buffer[row][1].draw(self)
+                continue
+
+            if not on_screen[kind][row]:
+                continue
+
+            if rgba != last_color:
+                color, last_color = pygame.Color(*rgba), rgba
+            draw_functions[kind](self._surface, *coordinates[kind][row], color)
+
+        self.draw_buffer = []
+        return len(order)
@@ -0,0 +1,453 @@
+"""
+The display-free core of rendering: fourier series of paths and their
+expansion over time. Neither pygame nor PIL is imported by this module
+or the modules it uses, so batch workers start quickly
+"""
+
+from fourier import (
+    exact_coefficients, fft_coefficients, harmonic_indices, select_terms
+)
+import extrapolate
+import path_file
+import cache
+
+from itertools import accumulate, count, tee
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import zipfile
+
+import numpy as np
+
+# The largest mismatch in time step that still counts as a constant step
+STEP_TOLERANCE = 1e-9
+
+# The default number of samples over one period of a trajectory table
+TABLE_SAMPLES = 4096
+TABLE_PRECISION = {"single": np.complex64, "double": np.complex128}
+
+# The largest number of complex exponentials evaluated at once for tips
+TIP_BLOCK_SIZE = 1 << 20
+
+
+def argand_transform(t, z):
+    """Returns an argand point representing a complex polar coordinate at angle t
+    Kept for compatibility, accumulations use a vectorised form of it
+    """
+    return (
+        complex(
+            z.real * math.cos(t) + z.imag * math.sin(t),
+            z.real * math.sin(t) - z.imag * math.cos(t),
+        )
+    )
+
+
+def path_coefficients(POINTS, n=1000, exact=False, steps=1000,
+                      use_cache=True, error=None, energy=None,
+                      significant=False):
+    """Returns a tuple of (harmonics, coefficients, period) for the path
+    There are 'n' terms in the same order as cycle_coefficients()
+    If 'exact' is True the coefficients are integrated in closed form,
+    otherwise the path is sampled 'steps' times.
+    If 'use_cache' is True coefficients are reused from previous runs
+    If 'error' or 'energy' is given, only the terms required to meet them
+    are kept, see fourier.select_terms()
+    """
+    POINTS = extrapolate.path_arrays(POINTS)
+    PERIOD = 2*math.pi * (POINTS[0][-1]//(2*math.pi) + 1)
+
+    def compute():
+        if exact:
+            return exact_coefficients(POINTS, PERIOD, n)[1]
+
+        PATH = extrapolate.linear_extrapolater(POINTS)
+        return fft_coefficients(PATH, PERIOD, n, steps, vectorised=True)[1]
+
+    if use_cache:
+        key = cache.path_key(
+            POINTS, PERIOD, n, exact=exact, steps=None if exact else steps
+        )
+        coefficients = cache.cached_coefficients(compute, key)
+    else:
+        coefficients = compute()
+
+    return select_series(
+        (harmonic_indices(n), coefficients, PERIOD), None, error, energy,
+        significant
+    )
+
+
+def select_series(series, n=None, error=None, energy=None, significant=False):
+    """Returns a tuple (harmonics, coefficients, period) of the terms of
+    'series' that path_coefficients() would keep.
+    Only the first 'n' terms are considered, if given. The 'error', 'energy'
+    and 'significant' parameters are passed to fourier.select_terms()
+    """
+    harmonics, coefficients, period = series
+    harmonics, coefficients = harmonics[:n], coefficients[:n]
+    total = len(harmonics)
+
+    if error is not None or energy is not None:
+        harmonics, coefficients, achieved = select_terms(
+            harmonics, coefficients, error, energy, significant
+        )
+        print(
+            f"Using {len(harmonics)} of {total} terms, "
+            f"RMS error {achieved:.3g}",
+            file=sys.stderr
+        )
+
+    return harmonics, coefficients, period
+
+
+def gen_radial_accumulation(POINTS, n=1000, exact=False, stepped=False,
+                            **settings):
+    """Calculates fourier coefficients and returns an expansion function
+    This generate a fourier accumulation at a given angle with 'n' terms
+    If 'stepped' is True the expansion is advanced incrementally
+    See path_coefficients() for the remaining parameters
+    """
+    series = path_coefficients(POINTS, n, exact, **settings)
+
+    if stepped:
+        return gen_stepped_accumulation(*series)
+    return gen_series_accumulation(*series)
+
+
+def gen_series_accumulation(harmonics, coefficients, period):
+    """Returns an expansion function for precomputed fourier coefficients
+    The function returns a complex array of the argand points of each
+    successive partial sum, starting with the origin
+    """
+    frequencies = np.ascontiguousarray(2j*math.pi * harmonics / period)
+    coefficients = np.ascontiguousarray(coefficients, dtype=np.complex128)
+
+    def radial_accumulation(t):
+        accumulation = np.zeros(len(coefficients)+1, dtype=np.complex128)
+        np.cumsum(coefficients * np.exp(frequencies*t), out=accumulation[1:])
+
+        # Vectorised argand_transform(t, z) == conj(z) * e^(it)
+        np.conjugate(accumulation, out=accumulation)
+        accumulation *= complex(math.cos(t), math.sin(t))
+        return accumulation
+
+    return radial_accumulation
+
+
+def gen_series_tip(harmonics, coefficients, period):
+    """Returns a function of an array of rotations that returns the last
+    point of the accumulation at each, radial_accumulation(t)[-1]
+    """
+    frequencies = np.ascontiguousarray(2j*math.pi * harmonics / period)
+    coefficients = np.ascontiguousarray(coefficients, dtype=np.complex128)
+    block = max(1, TIP_BLOCK_SIZE // max(1, len(coefficients)))
+
+    def pen_tip(t):
+        t = np.asarray(t, dtype=np.float64)
+        tips = np.empty(len(t), dtype=np.complex128)
+        for start in range(0, len(t), block):
+            part = t[start:start+block]
+            tips[start:start+block] = np.conjugate(
+                np.exp(np.outer(part, frequencies)) @ coefficients
+            ) * np.exp(1j*part)
+        return tips
+
+    return pen_tip
+
+
+def series_key(harmonics, coefficients, period):
+    """Returns a short hex digest identifying a fourier series
+    """
+    digest = hashlib.sha256(np.asarray(harmonics, dtype=np.int64).tobytes())
+    digest.update(np.asarray(coefficients, dtype=np.complex128).tobytes())
+    digest.update(repr(float(period)).encode())
+    return digest.hexdigest()[:16]
+
+
+def table_path(path_name, series):
+    """Returns the file name of the trajectory table of 'series'
+    The table is saved next to the path file 'path_name'
+    """
+    base = os.path.splitext(path_name)[0]
+    return f"{base}.{series_key(*series)}.table.npy"
+
+
+def build_trajectory_table(harmonics, coefficients, period, file_path,
+                           samples=TABLE_SAMPLES, dtype=np.complex64):
+    """Evaluates the accumulation at 'samples' rotations over one period
+    The (samples, terms+1) table is saved to the .npy file 'file_path'
+    and returned as a memory-mapped array
+    """
+    # Write then rename so an interrupted build is never loaded
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    table = np.lib.format.open_memmap(
+        temp_path, mode='w+', dtype=dtype,
+        shape=(samples, len(coefficients)+1)
+    )
+
+    # The rotation advances by a constant step, so each row is cheap
+    radial_accumulation = gen_stepped_accumulation(
+        harmonics, coefficients, period
+    )
+    for index in range(samples):
+        table[index] = radial_accumulation(index*period/samples)
+
+    table.flush()
+    del table
+    os.replace(temp_path, file_path)
+    return np.load(file_path, mmap_mode='r')
+
+
+def load_trajectory_table(series, file_path, samples=TABLE_SAMPLES,
+                          dtype=np.complex64):
+    """Returns the memory-mapped trajectory table saved in 'file_path'
+    The table is built first if it is missing or has different settings
+    """
+    shape = (samples, len(series[1])+1)
+    try:
+        table = np.load(file_path, mmap_mode='r')
+        if table.shape == shape and table.dtype == dtype:
+            return table
+    except (FileNotFoundError, ValueError):
+        pass
+
+    print(f"Building trajectory table {file_path}", file=sys.stderr)
+    return build_trajectory_table(*series, file_path, samples, dtype)
+
+
+def gen_table_accumulation(table, period):
+    """Returns an expansion function that plays back a trajectory table
+    Accumulations are linearly interpolated between the table's samples
+    """
+    samples = len(table)
+
+    def radial_accumulation(t):
+        position = (t % period) / period * samples
+        index = int(position) % samples
+        fraction = position - int(position)
+
+        current = table[index].astype(np.complex128)
+        following = table[(index+1) % samples]
+        current += (following - current) * fraction
+        return current
+
+    return radial_accumulation
+
+
+def gen_stepped_accumulation(harmonics, coefficients, period, renormalise=64):
+    """Returns an expansion function equivalent to gen_series_accumulation
+    While successive calls are a constant time step apart, each term's
+    phasor is advanced by a precomputed rotation instead of recomputed.
+    Phasors are renormalised every 'renormalise' steps to prevent drift
+    """
+    frequencies = np.ascontiguousarray(2j*math.pi * harmonics / period)
+    coefficients = np.ascontiguousarray(coefficients, dtype=np.complex128)
+
+    phasors, rotations = None, None
+    last_t, step, steps = None, None, 0
+
+    def radial_accumulation(t):
+        nonlocal phasors, rotations, last_t, step, steps
+
+        if last_t is not None and step is not None and (
+                abs(t - last_t - step) < STEP_TOLERANCE):
+            phasors *= rotations
+            steps += 1
+            if steps % renormalise == 0:
+                phasors /= np.abs(phasors)
+
+            # Track the expected time to avoid accumulating rounding error
+            last_t += step
+        else:
+            # The time step has changed, recompute everything
+            phasors = np.exp(frequencies*t)
+            if last_t is not None:
+                step = t - last_t
+                rotations = np.exp(frequencies*step)
+            last_t, steps = t, 0
+
+        accumulation = np.zeros(len(coefficients)+1, dtype=np.complex128)
+        np.cumsum(coefficients * phasors, out=accumulation[1:])
+
+        # Vectorised argand_transform(t, z) == conj(z) * e^(it)
+        np.conjugate(accumulation, out=accumulation)
+        accumulation *= complex(math.cos(t), math.sin(t))
+        return accumulation
+
+    return radial_accumulation
+
+
+def get_focal_points(accumulation):
+    """Returns a list of coefficient indexes and their outer_radius.
+    These significantly contribute to the overall shape.
+    """
+    global_radii = [0]+list(accumulate(
+        map(
+            lambda p: abs(p[0]-p[1]),
+            zip(accumulation, accumulation[1:])
+        )
+    ))
+
+    # A pair of iterators representing the radius of the expansion at each term
+    outer_radii = tee(map(
+        lambda radii: (global_radii[-1] - radii)/2,
+        global_radii
+    ))
+    # Skip the first term, so zip() can alternate values
+    next(outer_radii[1])
+
+    # Returns a list of the index and outer radius of each term
+    # Filter removes terms that dont make a significant contribution to radius
+    return list(
+        filter(
+            lambda val: val[1]*0.99 > val[2],
+            zip(count(), *outer_radii)
+        )
+    )
+
+
+def add_coefficient_arguments(parser):
+    """Adds the command line options of path_coefficients() to 'parser'
+    """
+    parser.add_argument(
+        "--terms", type=int,
+        help="the number of terms computed (default: 1000), or the number "
+             "of saved terms used"
+    )
+    parser.add_argument(
+        "--exact", action="store_true",
+        help="integrate the coefficients in closed form"
+    )
+    parser.add_argument(
+        "--error", type=float,
+        help="keep the fewest terms with an RMS error below ERROR"
+    )
+    parser.add_argument(
+        "--energy", type=float,
+        help="keep the fewest terms with this fraction of the energy"
+    )
+    parser.add_argument(
+        "--significant", action="store_true",
+        help="with --error or --energy, keep the largest terms anywhere"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="always recompute the coefficients"
+    )
+
+
+def coefficient_settings(args):
+    """Returns the keyword arguments of path_coefficients() from parsed
+    command line arguments, see add_coefficient_arguments()
+    """
+    settings = {
+        "exact": args.exact,
+        "error": args.error,
+        "energy": args.energy,
+        "significant": args.significant,
+        "use_cache": not args.no_cache,
+    }
+    if args.terms is not None:
+        settings["n"] = args.terms
+    return settings
+
+
+def save_series(file_path, series):
+    """Saves a tuple of (harmonics, coefficients, period) to 'file_path'
+    The format follows the extension: .json, .csv or otherwise .npz
+    """
+    harmonics, coefficients, period = series
+    period = float(period)
+    harmonics = np.asarray(harmonics, dtype=np.int64)
+    coefficients = np.asarray(coefficients, dtype=np.complex128)
+
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".json":
+        with open(file_path, 'w') as file:
+            json.dump({
+                "period": period,
+                "harmonics": harmonics.tolist(),
+                "real": coefficients.real.tolist(),
+                "imag": coefficients.imag.tolist(),
+            }, file)
+    elif extension == ".csv":
+        np.savetxt(
+            file_path,
+            np.column_stack((harmonics, coefficients.real, coefficients.imag)),
+            fmt=["%d", "%.17g", "%.17g"], delimiter=",",
+            header=f"period={period!r}\nharmonic,real,imag"
+        )
+    else:
+        with open(file_path, 'wb') as file:
+            np.savez(
+                file, harmonics=harmonics, coefficients=coefficients,
+                period=period
+            )
+
+
+def is_series_file(file_path):
+    """Returns True if 'file_path' holds a series saved as .npz
+    """
+    return zipfile.is_zipfile(file_path)
+
+
+def load_series(file_path):
+    """Returns the tuple of (harmonics, coefficients, period) saved as .npz
+    by save_series()
+    """
+    with np.load(file_path, allow_pickle=False) as saved:
+        return (
+            saved["harmonics"], saved["coefficients"], float(saved["period"])
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    coefficients = commands.add_parser(
+        "coefficients", help="compute and export the coefficients of a path"
+    )
+    coefficients.add_argument("path", help="a path file")
+    coefficients.add_argument(
+        "output", help="the file to save, .npz, .json or .csv"
+    )
+    add_coefficient_arguments(coefficients)
+    path_file.add_legacy_argument(coefficients)
+
+    table = commands.add_parser(
+        "table", help="build the trajectory table of a path, saved by it"
+    )
+    table.add_argument("path", help="a path file")
+    table.add_argument("--samples", type=int, default=TABLE_SAMPLES)
+    table.add_argument(
+        "--precision", choices=TABLE_PRECISION, default="single"
+    )
+    add_coefficient_arguments(table)
+    path_file.add_legacy_argument(table)
+
+    convert = commands.add_parser(
+        "convert", help="convert a pickled path to a path file"
+    )
+    convert.add_argument("pickle_path")
+    convert.add_argument("file_path")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        path_file.convert(args.pickle_path, args.file_path)
+    else:
+        series = path_coefficients(
+            path_file.load_any(args.path, args.legacy_pickle),
+            **coefficient_settings(args)
+        )
+        if args.command == "coefficients":
+            save_series(args.output, series)
+        else:
+            load_trajectory_table(
+                series, table_path(args.path, series), args.samples,
+                TABLE_PRECISION[args.precision]
+            )
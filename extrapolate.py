@@ -2,23 +2,78 @@
 Tools to convert cartesian coordinates to a polar path
 """
 
-from bisect import bisect_right
+from bisect import bisect_left
+
+import numpy as np
+
+
+def path_arrays(points):
+    """Returns a pair of contiguous arrays (angles, values) sorted by angle
+    'points' is either a list of (angle, complex) tuples or a pair of
+    arrays. Sorted contiguous arrays are returned without being copied
+    """
+    if isinstance(points, tuple) and isinstance(points[0], np.ndarray):
+        angles, values = points
+    else:
+        angles = np.fromiter((p[0] for p in points), dtype=np.float64)
+        values = np.fromiter((p[1] for p in points), dtype=np.complex128)
+
+    angles = np.ascontiguousarray(angles, dtype=np.float64)
+    values = np.ascontiguousarray(values, dtype=np.complex128)
+    if np.any(angles[1:] < angles[:-1]):
+        order = np.argsort(angles, kind="stable")
+        angles, values = angles[order], values[order]
+    return angles, values
 
 
 def linear_extrapolater(points):
     """Returns a function with argument 'phase'.
     This linearly extrapolates between the phase-value pairs in 'points'
-    in order to calculate the complex value at a given phase
+    in order to calculate the complex value at a given phase.
+    'phase' may also be an array, an array of values is then returned
     """
-    points = sorted(points)
+    angles, values = path_arrays(points)
 
-    def extrapolate(phase):
-        index = bisect_right(points, (phase,))
+    # Segment k joins point k-1 to point k, wrapping around at both ends
+    previous = np.arange(len(angles)+1) - 1
+    following = np.arange(len(angles)+1) % len(angles)
+    gradients = (values[previous]-values[following]) / (
+        angles[previous]-angles[following]
+    )
+    starts, origins = angles[previous], values[previous]
 
-        angle1, z1 = points[index - 1]
-        angle2, z2 = points[index % len(points)]
+    # Python lists are faster than arrays for single lookups
+    angle_list = angles.tolist()
+    start_list, origin_list = starts.tolist(), origins.tolist()
+    gradient_list = gradients.tolist()
 
-        gradient = (z1-z2) / (angle1-angle2)
-        return z1 + gradient * (phase - angle1)
+    def extrapolate(phase):
+        # Python numbers are checked first, np.ndim() dominates a scalar call
+        if isinstance(phase, (float, int)) or np.ndim(phase) == 0:
+            index = bisect_left(angle_list, phase)
+            return origin_list[index] + gradient_list[index] * (
+                phase - start_list[index]
+            )
+
+        index = np.searchsorted(angles, phase, side="left")
+        return origins[index] + gradients[index] * (phase - starts[index])
 
     return extrapolate
+
+
+def knots(points, period):
+    """Returns a pair of arrays (angles, values) describing the same path as
+    linear_extrapolater(points) over the whole range 0 <= phase <= period.
+    The path is linear between consecutive knots
+    """
+    angles, values = path_arrays(points)
+
+    # Outside the first and last points the path follows the wrapping segment
+    gradient = (values[-1]-values[0]) / (angles[-1]-angles[0])
+    start = values[0] + gradient * (0 - angles[0])
+    end = values[0] + gradient * (period - angles[0])
+
+    return (
+        np.concatenate(([0], angles, [period])),
+        np.concatenate(([start], values, [end]))
+    )
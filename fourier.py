@@ -4,7 +4,14 @@ Tools to create fourier series
 
 import math
 from functools import partial
-from itertools import count
+from itertools import count, islice
+
+import numpy as np
+
+import extrapolate
+
+# The largest number of complex exponentials evaluated at once
+EXACT_BLOCK_SIZE = 1 << 20
 
 
 def product_integral(f1, f2, lower, upper, steps=1000):
@@ -36,6 +43,13 @@ def cycle_coefficients():
         yield -n
 
 
+def harmonic_indices(n):
+    """Returns an integer array of the first 'n' harmonics
+    These are ordered in the same way as cycle_coefficients()
+    """
+    return np.fromiter(islice(cycle_coefficients(), n), dtype=np.int64, count=n)
+
+
 def complex_harmonic(period, sign, n, t):
     """Returns the complex exponent of the input sinusoid
     """
@@ -52,24 +66,246 @@ def fourier_sum(series, t):
     )
 
 
-def fourier_series(f, period):
+def coefficient_series(coefficients, period):
     """Returns an iterator of functions
+    'coefficients' is an iterable of tuples (int, complex)
     These represent the terms in the fourier series
     """
     harmonic = partial(complex_harmonic, period, 1)
     return map(
         lambda val: (lambda t: val[1] * harmonic(val[0], t)),
-        fourier_coefficients(f, period)
+        coefficients
+    )
+
+
+def fourier_series(f, period):
+    """Returns an iterator of functions
+    These represent the terms in the fourier series
+    """
+    return coefficient_series(fourier_coefficients(f, period), period)
+
+
+def sample_function(f, period, steps=1000, vectorised=False):
+    """Returns a complex array of 'steps' evenly spaced samples of f(t)
+    Samples are taken in the range 0 <= t < period
+    If 'vectorised' is True, f is called once with an array of every t
+    """
+    resolution = period/steps
+    if vectorised:
+        return np.asarray(
+            f(np.arange(steps)*resolution), dtype=np.complex128
+        )
+    return np.fromiter(
+        (f(n*resolution) for n in range(steps)),
+        dtype=np.complex128, count=steps
     )
 
 
-def fourier_coefficients(f, period):
+def fft_spectrum(f, period, steps=1000, vectorised=False):
+    """Returns the complex array of every coefficient resolvable with 'steps'
+    Index n holds the coefficient of harmonic n (negative harmonics wrap)
+    This matches product_integral() with the same 'steps' exactly
+    """
+    samples = sample_function(f, period, steps, vectorised)
+    return np.fft.fft(samples) / steps
+
+
+def fft_coefficients(f, period, n, steps=1000, vectorised=False):
+    """Returns a pair of arrays (harmonics, coefficients) with 'n' terms
+    Terms are ordered in the same way as cycle_coefficients()
+    The path is sampled once and all coefficients come from a single FFT
+    See sample_function() for 'vectorised'
+    """
+    harmonics = harmonic_indices(n)
+    spectrum = fft_spectrum(f, period, steps, vectorised)
+    return harmonics, spectrum[harmonics % steps]
+
+
+def fourier_coefficients(f, period, steps=1000):
     """Returns an iterator of tuples (int, complex)
     Index 0 represents the index of this term in the Fourier series
     Index 1 represents the complex coefficient
     """
+    spectrum = fft_spectrum(f, period, steps)
     for n in cycle_coefficients():
-        dot = partial(complex_harmonic, period, -1, n)
-        yield (n, 1/period * product_integral(
-            f, dot, 0, period
-        ))
+        yield (n, complex(spectrum[n % steps]))
+
+
+def exact_coefficients(points, period, n):
+    """Returns a pair of arrays (harmonics, coefficients) with 'n' terms
+    'points' is a path, as accepted by extrapolate.path_arrays()
+    The integral of each linear segment is evaluated in closed form,
+    so there is no sampling error
+    """
+    harmonics = harmonic_indices(n)
+    angles, values = extrapolate.knots(points, period)
+
+    # Zero length segments contribute nothing and have no gradient
+    keep = np.concatenate(([True], np.diff(angles) > 0))
+    angles, values = angles[keep], values[keep]
+    widths = np.diff(angles)
+    gradients = np.diff(values) / widths
+
+    # Integrating by parts, each knot is weighted by its change in gradient
+    kinks = np.diff(gradients, prepend=0, append=0)
+
+    coefficients = np.empty(n, dtype=np.complex128)
+    coefficients[harmonics == 0] = np.sum(
+        (values[1:] + values[:-1]) * widths
+    ) / (2*period)
+
+    nonzero = np.flatnonzero(harmonics)
+    block = max(1, EXACT_BLOCK_SIZE // len(angles))
+    for start in range(0, len(nonzero), block):
+        index = nonzero[start:start+block]
+        omega = 2*math.pi * harmonics[index] / period
+
+        exponents = np.exp(-1j * np.outer(omega, angles))
+        coefficients[index] = (
+            (values[-1]-values[0]) / (-1j*omega)
+            - (exponents @ kinks) / omega**2
+        ) / period
+
+    return harmonics, coefficients
+
+
+def select_terms(harmonics, coefficients, error=None, energy=None,
+                 significant=False):
+    """Returns a tuple (harmonics, coefficients, rms_error) of the fewest
+    terms that keep the RMS reconstruction error within 'error' and/or keep
+    the fraction 'energy' of the total spectral energy.
+    By Parseval's theorem the error is that of the dropped terms.
+    If 'significant' is True the largest terms are kept wherever they are,
+    otherwise the series is truncated. Terms keep their original order
+    """
+    power = np.abs(coefficients)**2
+    order = np.argsort(-power, kind="stable") if significant else (
+        np.arange(len(power))
+    )
+
+    # The error and energy after keeping the first k terms of 'order'
+    kept = np.concatenate(([0], np.cumsum(power[order])))
+    total = kept[-1]
+    errors = np.sqrt(np.maximum(total - kept, 0))
+
+    acceptable = np.ones(len(kept), dtype=bool)
+    if error is not None:
+        acceptable &= errors <= error
+    if energy is not None:
+        acceptable &= kept >= energy*total
+    count = int(np.argmax(acceptable)) if acceptable.any() else len(power)
+
+    keep = np.sort(order[:count])
+    return harmonics[keep], coefficients[keep], float(errors[count])
+
+
+class OnlineCoefficients():
+    """The closed form coefficients of a path that grows one point at a time
+    Coefficients match exact_coefficients() of the points added so far.
+    Adding a point costs O(n), except when the path starts a new
+    revolution. The period then changes and every term is recomputed
+    """
+    def __init__(self, n):
+        self.harmonics = harmonic_indices(n)
+        self.period = None
+
+        self._nonzero = np.flatnonzero(self.harmonics)
+        self._omega = None
+
+        self._first, self._last = None, None
+        self._count = 0
+        # The gradient of the last segment, and of the segment after the first
+        self._gradient, self._first_gradient = None, None
+        # The area under the segments between the first and last points
+        self._area = 0
+
+        # Every point between the first and the last, and their kinks
+        self._angles, self._kinks = [], []
+        # The sum of each of those kinks weighted by the harmonic's exponent
+        self._kink_sum = np.zeros(len(self._nonzero), dtype=np.complex128)
+
+    def __len__(self):
+        return self._count
+
+    def _set_period(self, period):
+        """Sets the period and recomputes the sum of weighted kinks
+        """
+        self.period = period
+        self._omega = 2*math.pi * self.harmonics[self._nonzero] / period
+
+        self._kink_sum[:] = 0
+        angles, kinks = np.array(self._angles), np.array(self._kinks)
+        block = max(1, EXACT_BLOCK_SIZE // max(1, len(self._omega)))
+        for start in range(0, len(angles), block):
+            exponents = np.exp(
+                -1j * np.outer(self._omega, angles[start:start+block])
+            )
+            self._kink_sum += exponents @ kinks[start:start+block]
+
+    def add_point(self, angle, value):
+        """Adds the next point of the path, as given by PathCreate.add_point()
+        Points that do not advance the angle are ignored
+        """
+        if self._last is not None and angle <= self._last[0]:
+            return
+
+        if self._last is not None:
+            last_angle, last_value = self._last
+            gradient = (value - last_value) / (angle - last_angle)
+            self._area += (value + last_value) * (angle - last_angle) / 2
+
+            if self._gradient is None:
+                self._first_gradient = gradient
+            else:
+                # The previous last point is now between the ends
+                kink = gradient - self._gradient
+                self._angles.append(last_angle)
+                self._kinks.append(kink)
+                if self._omega is not None:
+                    self._kink_sum += kink * np.exp(-1j*self._omega*last_angle)
+            self._gradient = gradient
+        else:
+            self._first = (angle, value)
+
+        self._last = (angle, value)
+        self._count += 1
+
+        period = 2*math.pi * (angle//(2*math.pi) + 1)
+        if period != self.period:
+            self._set_period(period)
+
+    def coefficients(self):
+        """Returns a pair of arrays (harmonics, coefficients)
+        At least two points are required
+        """
+        if self._count < 2:
+            raise ValueError("At least two points are required")
+
+        (first_angle, first_value), (last_angle, last_value) = (
+            self._first, self._last
+        )
+        period, omega = self.period, self._omega
+
+        # Outside the ends, the path follows the wrapping segment
+        wrap = (last_value - first_value) / (last_angle - first_angle)
+        start = first_value - wrap*first_angle
+        end = first_value + wrap*(period - first_angle)
+
+        coefficients = np.empty(len(self.harmonics), dtype=np.complex128)
+        coefficients[self.harmonics == 0] = (
+            (start + first_value) * first_angle
+            + 2*self._area
+            + (last_value + end) * (period - last_angle)
+        ) / (2*period)
+
+        # The kinks at the ends of the path, those at 0 and period cancel
+        kinks = (
+            self._kink_sum
+            + (self._first_gradient - wrap) * np.exp(-1j*omega*first_angle)
+            + (wrap - self._gradient) * np.exp(-1j*omega*last_angle)
+        )
+        coefficients[self._nonzero] = (
+            (end - start) / (-1j*omega) - kinks / omega**2
+        ) / period
+
+        return self.harmonics, coefficients
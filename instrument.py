@@ -0,0 +1,130 @@
+"""
+Per-frame timing of the stages of a render loop
+Keeps rolling percentiles of each stage and can export a timeline in the
+Chrome trace event format, for chrome://tracing or Perfetto
+"""
+
+from collections import deque
+import json
+import time
+
+import numpy as np
+
+# The number of recent frames used for percentiles
+WINDOW = 300
+PERCENTILES = (50, 95, 99)
+OVERLAY_COLOR = (255, 255, 0)
+
+
+class FrameProfiler():
+    """Times the stages of each frame
+    Call begin_frame(), then mark(stage) as each stage finishes, then
+    end_frame() with any counters, such as the number of shapes drawn
+    """
+    def __init__(self, window=WINDOW, trace=False):
+        """If 'trace' is True every frame is kept for write_trace()
+        """
+        self.window = window
+        self.stages = {}
+        self.counters = {}
+        self.frames = 0
+
+        self.events = [] if trace else None
+        self._origin = time.perf_counter()
+        self._frame_start = self._last = self._origin
+        self._font = None
+
+    def begin_frame(self):
+        self._frame_start = self._last = time.perf_counter()
+
+    def mark(self, stage):
+        """Records the time since the previous mark as the duration of 'stage'
+        """
+        now = time.perf_counter()
+        self._record(self.stages, stage, now - self._last)
+        if self.events is not None:
+            self._event(stage, self._last, now)
+        self._last = now
+
+    def end_frame(self, **counters):
+        """Completes the frame, keyword arguments are recorded as counters
+        """
+        now = time.perf_counter()
+        self._record(self.stages, "frame", now - self._frame_start)
+        for name, value in counters.items():
+            self._record(self.counters, name, value)
+
+        if self.events is not None:
+            self._event(f"frame {self.frames}", self._frame_start, now)
+            if counters:
+                self.events.append({
+                    "name": "counters", "ph": "C", "pid": 0, "tid": 0,
+                    "ts": self._microseconds(now), "args": counters
+                })
+        self.frames += 1
+
+    def _record(self, history, name, value):
+        if name not in history:
+            history[name] = deque(maxlen=self.window)
+        history[name].append(value)
+
+    def _microseconds(self, seconds):
+        return (seconds - self._origin) * 1e6
+
+    def _event(self, name, start, end):
+        self.events.append({
+            "name": name, "ph": "X", "pid": 0, "tid": 0,
+            "ts": self._microseconds(start), "dur": (end - start) * 1e6
+        })
+
+    def percentiles(self, name, percentiles=PERCENTILES):
+        """Returns the percentiles of the recent values of a stage or counter
+        Stage durations are in seconds
+        """
+        history = self.stages.get(name, self.counters.get(name))
+        if not history:
+            return [0.0] * len(percentiles)
+        return np.percentile(history, percentiles).tolist()
+
+    def summary(self):
+        """Returns a list of lines describing the recent percentiles
+        """
+        heading = " ".join(f"p{p:<6}" for p in PERCENTILES)
+        lines = [f"{'stage (ms)':<14} {heading}"]
+        for stage in self.stages:
+            values = " ".join(
+                f"{value*1000:<7.2f}" for value in self.percentiles(stage)
+            )
+            lines.append(f"{stage:<14} {values}")
+        for counter in self.counters:
+            values = " ".join(
+                f"{value:<7.0f}" for value in self.percentiles(counter)
+            )
+            lines.append(f"{counter:<14} {values}")
+        return lines
+
+    def draw_overlay(self, surface):
+        """Draws the summary in the top left of a pygame surface
+        """
+        import pygame
+
+        if self._font is None:
+            pygame.font.init()
+            self._font = pygame.font.SysFont("monospace", 14)
+
+        y = 4
+        for line in self.summary():
+            text = self._font.render(line, True, OVERLAY_COLOR)
+            surface.blit(text, (4, y))
+            y += text.get_height()
+
+    def write_trace(self, file_path):
+        """Saves the recorded frames in the Chrome trace event format
+        """
+        if self.events is None:
+            raise ValueError("The profiler was created without tracing")
+
+        with open(file_path, 'w') as file:
+            json.dump({
+                "traceEvents": self.events, "displayTimeUnit": "ms"
+            }, file)
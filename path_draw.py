@@ -3,16 +3,26 @@ A visual tool for constructing a path for rendering
 """
 
 import utils
+import path_file
+import simplify
+import expansion
+from fourier import OnlineCoefficients
 from path_tool import PathCreate
 from functools import partial
 
-import pickle
+import argparse
 import sys
 
+import numpy as np
 import pygame
 
 RENDER_RADIUS = 256
 
+# The number of terms in the live preview, and the points drawn along it
+PREVIEW_TERMS = 64
+PREVIEW_SAMPLES = 1024
+PREVIEW_COLOR = (0, 200, 255)
+
 # Coverts a screen coordinate to its complex representation
 from_screen_coord = partial(
     utils.from_vector_coord,
@@ -42,12 +52,57 @@ def mouse_down_event(event, btn):
     )
 
 
-def draw_image(screen, image, pos, size=(RENDER_RADIUS*2, RENDER_RADIUS*2)):
-    """Draws an pygame image to the screen with position 'pos' and size 'size'
+def scale_image(image, size=(RENDER_RADIUS*2, RENDER_RADIUS*2)):
+    """Returns a copy of a pygame image scaled to 'size', or None if there
+    is no image. The image is converted to the display's pixel format
+    """
+    if image is None:
+        return None
+
+    scaled = pygame.transform.scale(image, size)
+    if scaled.get_flags() & pygame.SRCALPHA:
+        return scaled.convert_alpha()
+    return scaled.convert()
+
+
+def path_screen_coords(angles, values):
+    """Returns a pair of integer arrays (x, y) of the screen coordinates of
+    path points. This is the vectorised inverse of utils.convert_base()
+    """
+    points = np.conjugate(values) * np.exp(1j*np.asarray(angles))
+    coord = (points+1+1j)*RENDER_RADIUS
+    return (
+        np.trunc(coord.real).astype(np.int64),
+        np.trunc(coord.imag).astype(np.int64)
+    )
+
+
+def rasterise_points(overlay, angles, values, color=(255, 0, 0)):
+    """Plots path points onto the overlay surface
+    Returns a list of the changed rects
+    """
+    x, y = path_screen_coords(angles, values)
+    inside = (
+        (x >= 0) & (x < overlay.get_width())
+        & (y >= 0) & (y < overlay.get_height())
+    )
+
+    rects = []
+    for point in zip(x[inside].tolist(), y[inside].tolist()):
+        overlay.set_at(point, color)
+        rects.append(pygame.Rect(point, (1, 1)))
+    return rects
+
+
+def redraw(screen, background, overlay, rects):
+    """Restores the background and overlay within each rect of 'rects'
+    'background' is a scaled image or None
     """
-    if image is not None:
-        scaled = pygame.transform.scale(image, size)
-        screen.blit(scaled, pos)
+    for rect in rects:
+        screen.fill((0, 0, 0), rect)
+        if background is not None:
+            screen.blit(background, rect, rect)
+        screen.blit(overlay, rect, rect)
 
 
 def load_image(image_path):
@@ -60,84 +115,162 @@ def load_image(image_path):
         return None
 
 
+def draw_preview(surface, rect, online, samples=PREVIEW_SAMPLES):
+    """Draws the fourier series of 'online', a fourier.OnlineCoefficients,
+    within 'rect' of the surface
+    """
+    surface.fill((0, 0, 0), rect)
+    if len(online) < 2:
+        return
+
+    harmonics, coefficients = online.coefficients()
+    phases = np.linspace(0, online.period, samples, endpoint=False)
+    frequencies = 2j*np.pi * harmonics / online.period
+    values = np.exp(np.outer(phases, frequencies)) @ coefficients
+
+    x, y = path_screen_coords(phases, values)
+    clip = surface.get_clip()
+    surface.set_clip(rect)
+    pygame.draw.aalines(
+        surface, PREVIEW_COLOR, True,
+        np.column_stack((x + rect.left, y + rect.top)).tolist()
+    )
+    surface.set_clip(clip)
+
+
 def draw_line(surface, color, offset, direction, scale):
-    """Draws a line of color to the surface.
+    """Draws a line of color to the surface and returns its bounding rect.
     Parameters are complex vectors representing offset, direction, and length
     """
     start = to_screen_coord(offset)
     end = to_screen_coord(offset+direction*scale)
 
-    pygame.draw.aaline(surface, color, start, end)
+    return pygame.draw.aaline(surface, color, start, end)
 
 
 def draw_selection_guides(screen, angle, selected):
     """Draws a pair of lines representing the current selection.
     Lines show the real and imaginary components of the polar representation
+    Returns a list of the bounding rects of the lines
     """
     direction = utils.unit_direction(angle)
 
     guide_start = selected.real * direction
     guide_end = selected.imag * utils.perpendicular(direction)
 
-    # Draws a line representing the real polar coordinate
-    draw_line(screen, (0, 180, 0), 0, direction, 1000)
-    # Draws a line representing the imaginary component of the polar coordinate
-    # (removed)
-    draw_line(screen, (255, 0, 0), guide_start, guide_end, 1)
+    return [
+        # Draws a line representing the real polar coordinate
+        draw_line(screen, (0, 180, 0), 0, direction, 1000),
+        # Draws a line representing the imaginary component of the polar
+        # coordinate (removed)
+        draw_line(screen, (255, 0, 0), guide_start, guide_end, 1),
+    ]
 
 
-def main(background_path):
+def main(background_path, tolerance=None, preview_terms=PREVIEW_TERMS):
+    """Traces a path over the image 'background_path'
+    If 'preview_terms' is not 0, a fourier series of that many terms is kept
+    up to date as points are added and drawn to the right of the input
+    """
     # Init
     pygame.init()
-    background = load_image(background_path)
-    screen = pygame.display.set_mode((RENDER_RADIUS*2, RENDER_RADIUS*2))
+    size = RENDER_RADIUS*2
+    screen = pygame.display.set_mode((size*2 if preview_terms else size, size))
+    input_rect = pygame.Rect(0, 0, size, size)
+    preview_rect = pygame.Rect(size, 0, size, size)
+    # The background is only scaled once
+    background = scale_image(load_image(background_path))
+
+    # The path is drawn once onto the overlay as each point is added
+    overlay = pygame.Surface(input_rect.size, pygame.SRCALPHA)
+    rasterised = 0
 
     angle, selected = 0, 0
     path_creator = PathCreate()
+    online = OnlineCoefficients(preview_terms) if preview_terms else None
 
     # Gameloop
     running, display_background = True, True
+    full_redraw, guide_rects = True, []
     while running:
-        # Clears the screen
-        screen.fill((0, 0, 0))
-
-        # Draw to screen
-        if display_background:
-            draw_image(screen, background, (0, 0))
+        if full_redraw:
+            dirty = [input_rect]
+        else:
+            # The previous guides are erased
+            dirty = list(guide_rects)
+
+        # Rasterises the points added since the last frame
+        added = rasterised < path_creator.length
+        if added:
+            angles, values = path_creator.path
+            dirty += rasterise_points(
+                overlay, angles[rasterised:], values[rasterised:]
+            )
+            rasterised = path_creator.length
+
+        if online is not None and (added or full_redraw):
+            draw_preview(screen, preview_rect, online)
+            dirty.append(preview_rect)
+
+        # The guides are kept out of the preview
+        screen.set_clip(input_rect)
+        redraw(screen, background if display_background else None,
+               overlay, dirty)
 
         # Draws the debug selection guides
-        draw_selection_guides(screen, angle, selected)
-
-        # Draws the current path onto the screen
-        for theta, point in path_creator.path:
-            direction = utils.unit_direction(theta)
-
-            start_guide = point.real * direction
-            end_guide = point.imag * utils.perpendicular(direction)
-            screen.set_at(to_screen_coord(start_guide+end_guide), (255, 0, 0))
+        guide_rects = draw_selection_guides(screen, angle, selected)
+        screen.set_clip(None)
+        full_redraw = False
 
         # Events
         for event in pygame.event.get():
-            if mouse_down_event(event, pygame.BUTTON_LEFT):
+            if mouse_down_event(event, pygame.BUTTON_LEFT) and (
+                input_rect.collidepoint(event.pos)
+            ):
                 pos = from_screen_coord(event.pos)
                 angle, selected = path_creator.add_point(pos)
+                if online is not None:
+                    online.add_point(angle, selected)
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_h:
                     display_background = not display_background
+                    full_redraw = True
                 if event.key == pygame.K_RETURN:
-                    # Save the whole path to out.p
-                    with open("out.p", 'wb+') as out:
-                        pickle.dump(path_creator.path, out)
+                    # Save the whole path to out.path
+                    path = path_creator.path
+                    if tolerance is not None:
+                        path = simplify.reduce_path(path, tolerance)
+                    path_file.save("out.path", path)
+
+                    # The preview's coefficients can be rendered directly
+                    if online is not None and len(online) >= 2:
+                        expansion.save_series(
+                            "out.npz", (*online.coefficients(), online.period)
+                        )
 
                     running = False
 
             if event.type == pygame.QUIT:
                 running = False
 
-        pygame.display.flip()
+        # Only the changed parts of the screen are refreshed
+        pygame.display.update(dirty + guide_rects)
 
     print("Finshed")
 
 
 if __name__ == "__main__":
-    main(sys.argv[1])
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("background", help="an image to trace over")
+    parser.add_argument(
+        "--simplify", type=float, metavar="TOLERANCE",
+        help="remove points while the path stays within TOLERANCE"
+    )
+    parser.add_argument(
+        "--preview-terms", type=int, default=PREVIEW_TERMS, metavar="COUNT",
+        help="the number of terms in the live preview, also saved to out.npz "
+             f"for render.py. 0 disables the preview (default: {PREVIEW_TERMS})"
+    )
+    args = parser.parse_args()
+
+    main(args.background, args.simplify, args.preview_terms)
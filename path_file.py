@@ -0,0 +1,176 @@
+"""
+A versioned binary file format for paths
+
+The file is a 32 byte header followed by a float64 array of angles and
+a complex128 array of values, both little endian. Arrays are memory-mapped
+when loaded, so they are never copied
+"""
+
+import argparse
+import os
+import pickle
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = b"FOURPATH"
+VERSION = 1
+# Magic, version, flags, number of points, padding for alignment
+HEADER = struct.Struct("<8sIIQ8x")
+
+ANGLE_TYPE = np.dtype("<f8")
+VALUE_TYPE = np.dtype("<c16")
+
+
+class PathWriter():
+    """Streams the points of a path to a file
+    Values are spilled to a temporary file until the writer is closed
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.count = 0
+
+        self._angles = open(file_path, 'wb+')
+        self._angles.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        self._values = tempfile.TemporaryFile(
+            dir=os.path.dirname(os.path.abspath(file_path))
+        )
+
+    def write(self, angle, value):
+        """Appends a single point to the path
+        """
+        self.write_many([angle], [value])
+
+    def write_many(self, angles, values):
+        """Appends arrays of angles and values to the path
+        """
+        angles = np.asarray(angles, dtype=ANGLE_TYPE)
+        values = np.asarray(values, dtype=VALUE_TYPE)
+        if len(angles) != len(values):
+            raise ValueError("Every angle requires a value")
+
+        self._angles.write(angles.tobytes())
+        self._values.write(values.tobytes())
+        self.count += len(angles)
+
+    def close(self):
+        """Completes the file by appending the values and writing the header
+        """
+        if self._angles.closed:
+            return
+
+        self._values.seek(0)
+        while chunk := self._values.read(1 << 20):
+            self._angles.write(chunk)
+        self._values.close()
+
+        self._angles.seek(0)
+        self._angles.write(HEADER.pack(MAGIC, VERSION, 0, self.count))
+        self._angles.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def save(file_path, points):
+    """Saves a path to 'file_path'
+    'points' is a path, as accepted by extrapolate.path_arrays()
+    """
+    if isinstance(points, tuple) and isinstance(points[0], np.ndarray):
+        angles, values = points
+    else:
+        angles = np.fromiter((p[0] for p in points), dtype=ANGLE_TYPE)
+        values = np.fromiter((p[1] for p in points), dtype=VALUE_TYPE)
+
+    with PathWriter(file_path) as writer:
+        writer.write_many(angles, values)
+
+
+def is_path_file(file_path):
+    """Returns True if 'file_path' starts with the header of a path file
+    """
+    with open(file_path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def load(file_path):
+    """Returns a pair of read only memory-mapped arrays (angles, values)
+    """
+    with open(file_path, 'rb') as file:
+        header = file.read(HEADER.size)
+    if len(header) != HEADER.size:
+        raise ValueError(f"{file_path} is too short to be a path file")
+
+    magic, version, _, count = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError(f"{file_path} is not a path file")
+    if version != VERSION:
+        raise ValueError(f"{file_path} has unsupported version {version}")
+
+    expected = HEADER.size + count*(ANGLE_TYPE.itemsize + VALUE_TYPE.itemsize)
+    if os.path.getsize(file_path) != expected:
+        raise ValueError(f"{file_path} is truncated or corrupt")
+
+    if count == 0:
+        return np.empty(0, ANGLE_TYPE), np.empty(0, VALUE_TYPE)
+
+    angles = np.memmap(
+        file_path, dtype=ANGLE_TYPE, mode='r',
+        offset=HEADER.size, shape=(count,)
+    )
+    values = np.memmap(
+        file_path, dtype=VALUE_TYPE, mode='r',
+        offset=HEADER.size + count*ANGLE_TYPE.itemsize, shape=(count,)
+    )
+    return angles, values
+
+
+def load_any(file_path, legacy_pickle=False):
+    """Returns the path stored in 'file_path'
+    Path files are loaded as a pair of arrays (angles, values). Other files
+    raise a ValueError, unless 'legacy_pickle' is True and they are unpickled
+    as a legacy list of (angle, complex) tuples.
+    Only unpickle files from a trusted source
+    """
+    if is_path_file(file_path):
+        return load(file_path)
+
+    if not legacy_pickle:
+        raise ValueError(
+            f"{file_path} is not a path file, convert a pickled path "
+            "with path_file.py or load it with --legacy-pickle"
+        )
+    with open(file_path, 'rb') as file:
+        return pickle.load(file)
+
+
+def add_legacy_argument(parser):
+    """Adds the --legacy-pickle option, passed on to load_any(), to an
+    argparse parser
+    """
+    parser.add_argument(
+        "--legacy-pickle", action="store_true",
+        help="also load pickled paths, only use this for trusted files"
+    )
+
+
+def convert(pickle_path, file_path):
+    """Converts a legacy pickled path to a path file
+    """
+    with open(pickle_path, 'rb') as file:
+        save(file_path, pickle.load(file))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Converts a pickled path (eg. paths/out.p) to a path file"
+    )
+    parser.add_argument("pickle_path")
+    parser.add_argument("file_path")
+    args = parser.parse_args()
+
+    convert(args.pickle_path, args.file_path)
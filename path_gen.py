@@ -1,14 +1,24 @@
 """
 A tool for generating a path from an image
+Pillow is only imported by the functions that read or show images
 """
 
 import utils
+import path_file
+import simplify
 from path_tool import PathCreate
 
+import argparse
+import multiprocessing
+import os
 import sys
-import pickle
+import tempfile
+import time
+from array import array
+from collections import deque
 from functools import partial
-from PIL import Image
+
+import numpy as np
 
 # The significant colors on the image
 BLANK_COLOR = (255, 255, 255)
@@ -17,33 +27,98 @@ END_COLOR = (0, 0, 255)
 
 # A large constant for path finding
 BIG_NUMBER = (1 << 32)
+# The classes of pixel stored in ImageData.pixels
+BLANK, PATH, START, END = range(4)
 # The pixels around (0, 0) to scan while path finding
 SCAN_OFFSETS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+DIAGONAL_OFFSETS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+# Distance values of cells that are not yet reached, or cannot be
+UNVISITED = -1
+WALL = np.iinfo(np.int32).max
+
+# The default memory budget of tiled image processing in bytes
+TILE_BUDGET = 64 * (1 << 20)
+# An upper bound on the working memory used to classify each pixel
+TILE_BYTES_PER_PIXEL = 24
+# Uncompressed image layouts that can be read straight from the file
+RAW_CHANNELS = {"RGB": 3, "BGR": 3, "L": 1}
+# The number of points converted to polar form at once while saving
+SAVE_BLOCK = 1 << 16
 
 
 class ImageData():
     """A container for storing the data extracted from the path image
+    'pixels' is a (height, width) grid of pixel classes
+
+    Distances are held in a flat int32 array, surrounded by a border of
+    walls one pixel wide so neighbours never need bounds checking.
+    Prepared 'distance' and 'towards' arrays may be given instead of pixels
     """
-    def __init__(self, size):
+    def __init__(self, size, pixels=None, distance=None, towards=None):
         self.start, self.end = None, None
+        self.starts, self.ends = [], []
         self.size = size
-        self.data = [[BIG_NUMBER]*size[1] for _ in range(size[0])]
+        self.stride = size[0] + 2
+
+        if distance is None:
+            if pixels is None:
+                pixels = np.full((size[1], size[0]), BLANK, dtype=np.uint8)
+            distance = np.where(
+                np.pad(pixels != BLANK, 1).ravel(), UNVISITED, WALL
+            ).astype(np.int32)
+        if towards is None:
+            towards = np.full(len(distance), -1, dtype=np.int8)
+
+        self.pixels = pixels
+        self.distance = distance
+        # The index into 'offsets' of the neighbour one step closer to the end
+        self.towards = towards
+        self.offsets = neighbour_offsets(self.stride)
+
+    def index(self, point):
+        """Returns the flat index of the coordinate tuple 'point'
+        """
+        return (point[1]+1)*self.stride + point[0]+1
+
+    def coord(self, index):
+        """Returns the coordinate tuple of the flat index 'index'
+        """
+        y, x = divmod(index, self.stride)
+        return (x-1, y-1)
+
+    def in_bounds(self, point):
+        return 0 <= point[0] < self.size[0] and 0 <= point[1] < self.size[1]
 
     def __setitem__(self, index, value):
-        try:
-            self.data[index[1]][index[0]] = value
-        except IndexError:
+        if not self.in_bounds(index):
             # Out of bounds, ignore write
-            # print("Index set error")
-            pass
+            return
+        self.distance[self.index(index)] = UNVISITED if value is None else (
+            min(value, WALL)
+        )
 
     def __getitem__(self, index):
-        try:
-            return self.data[index[1]][index[0]]
-        except IndexError:
+        if not self.in_bounds(index):
             # Default value used, no need for bound checking
             return BIG_NUMBER
 
+        value = int(self.distance[self.index(index)])
+        if value == UNVISITED:
+            return None
+        return BIG_NUMBER if value == WALL else value
+
+
+def neighbour_offsets(stride, connectivity=4):
+    """Returns a list of the flat index offsets of the surrounding pixels
+    'connectivity' is either 4 or 8, 8 includes the diagonals
+    """
+    if connectivity not in (4, 8):
+        raise ValueError("Connectivity must be either 4 or 8")
+
+    offsets = SCAN_OFFSETS + (DIAGONAL_OFFSETS if connectivity == 8 else [])
+    return [dy*stride + dx for dx, dy in offsets]
+
 
 def get_surroundings(data, point):
     """Returns an iterator of the surrounding coordinates
@@ -72,101 +147,360 @@ def is_color(c1, c2, delta=50):
             abs(c1[2]-c2[2]) < delta)
 
 
+def color_mask(pixels, color, delta=50):
+    """Returns a boolean array, True where a pixel matches 'color'
+    'pixels' is an array of RGB values, matched as is_color() does
+    """
+    difference = np.abs(pixels.astype(np.int16) - np.array(color, np.int16))
+    return np.all(difference < delta, axis=-1)
+
+
+def classify_pixels(pixels):
+    """Returns a uint8 grid of the pixel class of each RGB value in 'pixels'
+    """
+    grid = np.full(pixels.shape[:2], PATH, dtype=np.uint8)
+    grid[color_mask(pixels, START_COLOR)] = START
+    grid[color_mask(pixels, END_COLOR)] = END
+    grid[color_mask(pixels, BLANK_COLOR)] = BLANK
+    return grid
+
+
+def marker_coords(grid, marker):
+    """Returns a list of (x, y) coordinates of every pixel of class 'marker'
+    Coordinates are ordered by row, then column
+    """
+    ys, xs = np.nonzero(grid == marker)
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
 def get_image_data(image_path):
     """Converts an image with path 'image_path' to and ImageData object
     """
+    from PIL import Image
+
     im = Image.open(image_path).convert("RGB")
 
+    grid = classify_pixels(np.asarray(im))
+    data = ImageData(im.size, grid)
+
+    data.starts, data.ends = marker_coords(grid, START), marker_coords(grid, END)
+    report_markers(data)
+    return data
+
+
+def report_markers(data):
+    """Chooses and prints the start and end of the path in ImageData 'data'
+    The last marker pixel in reading order is used
+    """
+    for name, markers in (("start", data.starts), ("end", data.ends)):
+        if len(markers) > 1:
+            print(f"Found {len(markers)} {name} pixels", file=sys.stderr)
+
+    if data.starts:
+        data.start = data.starts[-1]
+        print(f"Path start: {data.start}")
+    if data.ends:
+        data.end = data.ends[-1]
+        print(f"Path end: {data.end}")
+
+
+def raw_image_layout(im):
+    """Returns a tuple (offset, stride, rawmode, orientation) describing the
+    rows of the Pillow image 'im' in its file, or None if its pixels are not
+    stored uncompressed. 'orientation' is -1 if the rows are stored bottom up
+    """
+    if len(im.tile) != 1 or im.tile[0][0] != "raw":
+        return None
+
+    _, extents, offset, args = im.tile[0]
+    rawmode, stride, orientation = (
+        (args, 0, 1) if isinstance(args, str) else args
+    )
+    width, height = im.size
+    if rawmode not in RAW_CHANNELS or extents != (0, 0, width, height):
+        return None
+
+    return offset, stride or width*RAW_CHANNELS[rawmode], rawmode, orientation
+
+
+def image_strips(im, layout, rows):
+    """Yields tuples (y, pixels) where pixels is an RGB array of at most
+    'rows' rows of the image, starting at row y.
+    Each strip is read from the file on its own, 'layout' is given by
+    raw_image_layout()
+    """
+    offset, stride, rawmode, orientation = layout
     width, height = im.size
-    pixels = im.load()
-    data = ImageData(im.size)
-    for y in range(height):
-        for x in range(width):
-            if is_color(pixels[x, y], BLANK_COLOR):
-                continue
-
-            data[x, y] = None
-            if is_color(pixels[x, y], START_COLOR):
-                data.start = (x, y)
-                print(f"Path start: {data.start}")
-            if is_color(pixels[x, y], END_COLOR):
-                data.end = (x, y)
-                print(f"Path end: {data.end}")
+    channels = RAW_CHANNELS[rawmode]
+
+    with open(im.filename, 'rb') as file:
+        for y in range(0, height, rows):
+            bottom = min(y+rows, height)
+            first = y if orientation == 1 else height-bottom
+            file.seek(offset + first*stride)
+            strip = np.fromfile(file, np.uint8, (bottom-y)*stride).reshape(
+                bottom-y, stride
+            )[::orientation, :width*channels].reshape(bottom-y, width, channels)
+
+            if rawmode == "BGR":
+                strip = strip[:, :, ::-1]
+            yield y, np.broadcast_to(strip, (bottom-y, width, 3))
+
+
+def mapped_array(directory, dtype, shape):
+    """Returns a zeroed numpy array backed by an anonymous file in directory
+    The file is removed once the array is no longer referenced
+    """
+    return np.memmap(
+        tempfile.TemporaryFile(dir=directory), dtype=dtype, mode='w+',
+        shape=shape
+    )
+
+
+def get_tiled_image_data(image_path, budget=TILE_BUDGET, directory=None):
+    """Converts an image with path 'image_path' to and ImageData object
+    The image is processed in strips of rows and stored in memory-mapped
+    files in 'directory', so the working memory stays within 'budget' bytes.
+    'directory' should be on disk, a tmpfs directory is held in memory.
+    Only uncompressed images, such as PPM or BMP, can be read in strips,
+    other images raise a ValueError
+    """
+    from PIL import Image
+
+    im = Image.open(image_path)
+    layout = raw_image_layout(im)
+    if layout is None:
+        raise ValueError(
+            f"{image_path} cannot be decoded in strips, convert it to an "
+            "uncompressed format such as PPM or BMP, or trace it untiled"
+        )
+
+    width, height = im.size
+    rows = max(1, budget // (TILE_BYTES_PER_PIXEL*(width+2)))
+
+    distance = mapped_array(directory, np.int32, (height+2, width+2))
+    towards = mapped_array(directory, np.int8, (height+2)*(width+2))
+
+    # The border is always a wall
+    distance[0], distance[-1] = WALL, WALL
+    towards[:width+2], towards[-(width+2):] = -1, -1
+
+    starts, ends = [], []
+    for y, pixels in image_strips(im, layout, rows):
+        grid = classify_pixels(pixels)
+        path = grid != BLANK
+
+        distance[y+1:y+1+len(grid)] = np.pad(
+            np.where(path, UNVISITED, WALL), ((0, 0), (1, 1)),
+            constant_values=WALL
+        )
+        towards[(y+1)*(width+2):(y+1+len(grid))*(width+2)] = -1
+
+        starts += [(x, y+dy) for x, dy in marker_coords(grid, START)]
+        ends += [(x, y+dy) for x, dy in marker_coords(grid, END)]
+
+    data = ImageData((width, height), None, distance.reshape(-1), towards)
+    data.starts, data.ends = starts, ends
+    report_markers(data)
     return data
 
 
-def fill_image_data(data):
+def fill_image_data(data, connectivity=4):
     """Finds the shortest path length between each point and the end point
+    Each reached pixel also records the neighbour one step closer to the end
     MUTATES the ImageData input object
     """
-    data[data.end] = 0
+    data.offsets = neighbour_offsets(data.stride, connectivity)
+    directions = list(enumerate(data.offsets))
 
-    next_queue = []
-    queue = [(0, data.end)]
-    while queue:
-        while queue:
-            cost, coord = queue.pop()
-            if coord == data.start:
-                return
+    # Memoryviews give fast scalar access to the flat arrays
+    distance, towards = memoryview(data.distance), memoryview(data.towards)
+    start, end = data.index(data.start), data.index(data.end)
 
-            for point in filter_surroundings(data, coord, lambda x: x is None):
-                data[point] = cost+1
-                next_queue.append((cost+1, point))
+    distance[end] = 0
+    queue = deque([end])
+    while queue:
+        cell = queue.popleft()
+        if cell == start:
+            return
 
-        queue = next_queue
-        next_queue = []
+        cost = distance[cell] + 1
+        for direction, offset in directions:
+            neighbour = cell - offset
+            if distance[neighbour] == UNVISITED:
+                distance[neighbour] = cost
+                towards[neighbour] = direction
+                queue.append(neighbour)
 
 
 def shortest_path(data):
-    """Returns a list of coordinate tuples. 'data' is of type ImageData
-    These represent the shortest path between 'start' and 'end'
-    """
-    path = [data.start]
-    while path[-1] != data.end:
-        next_point = min(
-            (data[point], point)
-            for point in filter_surroundings(data, path[-1])
-        )
-        path.append(next_point[1])
-
+    """Returns an (N, 2) int array of the (x, y) coordinates of each pixel on
+    the shortest path between 'start' and 'end'. 'data' is of type ImageData
+    """
+    cell, end = data.index(data.start), data.index(data.end)
+    if cell != end and data.towards[cell] < 0:
+        raise ValueError("The start of the path is not connected to its end")
+
+    # A typed array keeps long paths compact
+    towards, offsets = memoryview(data.towards), data.offsets
+    cells = array("q", [cell])
+    while cell != end:
+        cell += offsets[towards[cell]]
+        cells.append(cell)
+
+    path = np.empty((len(cells), 2), dtype=np.int64)
+    np.divmod(np.frombuffer(cells, dtype=np.int64), data.stride,
+              out=(path[:, 1], path[:, 0]))
+    path -= 1
     return path
 
 
 def show_path(path, size):
     """Uses Pillow to display a visual representation of the path.
-    'path' is a list of coordinate tuples
+    'path' is an (N, 2) array of pixel coordinates
     """
-    im = Image.new('RGB', size)
-    data = im.load()
+    from PIL import Image
 
-    data[path[0]] = (255, 0, 0)
-    data[path[-1]] = (0, 0, 255)
-    for pixel in path[1:-1]:
-        data[pixel] = (255, 255, 255)
-    data[size[0]//2, size[1]//2] = (255, 255, 255)
-    im.show()
+    pixels = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    pixels[path[1:-1, 1], path[1:-1, 0]] = (255, 255, 255)
+    pixels[path[0, 1], path[0, 0]] = (255, 0, 0)
+    pixels[path[-1, 1], path[-1, 0]] = (0, 0, 255)
+    pixels[size[1]//2, size[0]//2] = (255, 255, 255)
+    Image.fromarray(pixels).show()
 
 
-def save_path(path, size, file_path):
-    """Uses Pillow to display a visual representation of the path.
-    'path' is a list of coordinate tuples
+def save_path(path, size, file_path, tolerance=None, count=None):
+    """Converts the path to polar form and streams it to a path file.
+    'path' is an (N, 2) array of pixel coordinates
+    If 'tolerance' or 'count' is given, the path is reduced before saving
+    See simplify.reduce_path()
     """
+    path = np.asarray(path).reshape(-1, 2)
+
+    def add_path(creator):
+        # Blocks keep the conversion of long paths small
+        for first in range(0, len(path), SAVE_BLOCK):
+            pixels = path[first:first+SAVE_BLOCK].astype(np.float64)
+            creator.add_points(
+                (pixels[:, 0]/(size[0]//2) - 1)
+                + 1j*(pixels[:, 1]/(size[1]//2) - 1)
+            )
+
+    if tolerance is None and count is None:
+        with path_file.PathWriter(file_path) as writer:
+            add_path(PathCreate(writer))
+        return
+
     creator = PathCreate()
-    coord_convert = partial(utils.from_vector_coord, (size[0]//2, size[1]//2))
+    add_path(creator)
+    path_file.save(file_path, simplify.reduce_path(
+        creator.path, tolerance, count
+    ))
+
+
+def trace_image(image_path, tiled=False, budget=TILE_BUDGET, connectivity=4,
+                directory=None):
+    """Returns a tuple (path, size, timings) for the image at 'image_path'
+    'path' is the shortest path from start to end, see shortest_path()
+    'timings' is a list of (stage, seconds) tuples
+    Tiled images are stored in 'directory', see get_tiled_image_data()
+    """
+    timings = []
+    stage_start = time.perf_counter()
 
-    for pixel in path:
-        creator.add_point(coord_convert(pixel))
+    def finish(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings.append((stage, now-stage_start))
+        stage_start = now
 
-    with open(file_path, 'wb+') as file:
-        pickle.dump(creator.path, file)
+    if tiled:
+        data = get_tiled_image_data(image_path, budget, directory)
+    else:
+        data = get_image_data(image_path)
+    finish("load")
+
+    fill_image_data(data, connectivity)
+    finish("fill")
+
+    path = shortest_path(data)
+    finish("path")
+
+    return path, data.size, timings
+
+
+def trace_images(image_paths, processes=None, **settings):
+    """Yields a tuple (image_path, path, size, timings) for each image
+    Images are traced in parallel, results are in the order of 'image_paths'
+    'settings' are passed to trace_image()
+    """
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.imap(partial(trace_image, **settings), image_paths)
+        for image_path, (path, size, timings) in zip(image_paths, results):
+            yield image_path, path, size, timings
 
 
 if __name__ == "__main__":
-    full_path = []
-    for path in sys.argv[1:]:
-        data = get_image_data(path)
-        fill_image_data(data)
-        full_path.extend(shortest_path(data))
-
-    show_path(full_path, data.size)
-    save_path(full_path, data.size, "out.p")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("images", nargs="+", help="trace images, in order")
+    parser.add_argument(
+        "--output", default="out.path", help="the path file to save"
+    )
+    parser.add_argument(
+        "--simplify", type=float, metavar="TOLERANCE",
+        help="remove points while the path stays within TOLERANCE"
+    )
+    parser.add_argument(
+        "--resample", type=int, metavar="COUNT",
+        help="resample to COUNT points evenly spaced by arc length"
+    )
+    parser.add_argument(
+        "--no-preview", action="store_true",
+        help="do not display the combined path before saving"
+    )
+    parser.add_argument(
+        "--processes", type=int, default=None,
+        help="the number of images traced at once (default: every core)"
+    )
+    parser.add_argument(
+        "--connectivity", type=int, choices=(4, 8), default=4,
+        help="the pixels a path can step to, 8 includes diagonals"
+    )
+    parser.add_argument(
+        "--tiled", action="store_true",
+        help="process each image in strips, stored in memory-mapped files"
+    )
+    parser.add_argument(
+        "--memory-budget", type=int, default=TILE_BUDGET >> 20, metavar="MB",
+        help="the working memory of --tiled processing in megabytes"
+    )
+    parser.add_argument(
+        "--scratch", metavar="DIRECTORY",
+        help="where --tiled stores its memory-mapped files, this should not "
+             "be a tmpfs (default: the directory of --output)"
+    )
+    args = parser.parse_args()
+
+    scratch = args.scratch
+    if scratch is None:
+        scratch = os.path.dirname(os.path.abspath(args.output))
+
+    paths = []
+    traced = trace_images(
+        args.images, args.processes, tiled=args.tiled,
+        budget=args.memory_budget << 20, connectivity=args.connectivity,
+        directory=scratch
+    )
+    for done, (image_path, path, size, timings) in enumerate(traced, 1):
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings)
+        print(
+            f"[{done}/{len(args.images)}] {image_path}: "
+            f"{len(path)} pixels ({stages})",
+            file=sys.stderr
+        )
+        paths.append(path)
+
+    full_path = np.concatenate(paths)
+    if not args.no_preview:
+        show_path(full_path, size)
+    save_path(full_path, size, args.output, args.simplify, args.resample)
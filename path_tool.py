@@ -6,15 +6,57 @@ Converts a series of argand vectors into their corresponding complex polar path
 import utils
 import math
 
+import numpy as np
+
 # Contant, experimentally determined
 # Small values can produce more complex shapes but converge slowly
 ANGLE_INC = 0.001
 
+# The initial number of points the path storage can hold
+INITIAL_CAPACITY = 1024
+
 
 class PathCreate():
-    def __init__(self):
+    def __init__(self, writer=None):
+        """'writer' is an optional path_file.PathWriter
+        Each new point of the path is also streamed to the writer
+        """
         self.angle = 0
-        self.path = []
+        self.writer = writer
+
+        self.length = 0
+        self._angles = np.empty(INITIAL_CAPACITY, dtype=np.float64)
+        self._values = np.empty(INITIAL_CAPACITY, dtype=np.complex128)
+
+    @property
+    def path(self):
+        """Returns the path as a pair of arrays (angles, values)
+        The arrays are views of the storage and are only valid until the
+        next point is added
+        """
+        return self._angles[:self.length], self._values[:self.length]
+
+    def _reserve(self, count):
+        """Grows the path storage so 'count' more points can be added
+        """
+        required = self.length + count
+        if required <= len(self._angles):
+            return
+
+        capacity = max(required, 2*len(self._angles))
+        self._angles = np.resize(self._angles, capacity)
+        self._values = np.resize(self._values, capacity)
+
+    def _append(self, angles, values):
+        """Stores arrays of new path angles and values
+        """
+        self._reserve(len(angles))
+        self._angles[self.length:self.length+len(angles)] = angles
+        self._values[self.length:self.length+len(values)] = values
+        self.length += len(angles)
+
+        if self.writer is not None:
+            self.writer.write_many(angles, values)
 
     def revolutions(self):
         """Returns the number of revolutions required to produce the current path
@@ -43,5 +85,48 @@ class PathCreate():
         direction = utils.unit_direction(self.phase())
         selection = utils.convert_base(direction, point)
 
-        self.path.append((self.angle, selection))
-        return self.path[-1]
+        self._append([self.angle], [selection])
+        return self.angle, selection
+
+    def add_points(self, points):
+        """Adds an array of complex vectors to the path
+        The result is identical to calling add_point() on each in turn
+        Returns a pair of arrays of the new angles and complex values
+        """
+        points = np.asarray(points, dtype=np.complex128)
+        angles = np.empty(len(points), dtype=np.float64)
+
+        # Unwrapping depends on the previous angle, so it cannot be
+        # vectorised. This is add_point() and utils.is_lagging() inlined
+        tau, half_turn = 2*math.pi, math.pi
+        angle = self.angle
+        for index, (x, y) in enumerate(
+            zip(points.real.tolist(), points.imag.tolist())
+        ):
+            point_angle = math.atan2(y, x) % tau
+            current = angle % tau
+            if 0.5*half_turn < current < 1.5*half_turn:
+                lagging = current < point_angle
+            else:
+                lagging = (angle - half_turn) % tau < (
+                    point_angle - half_turn) % tau
+
+            if lagging:
+                new_angle = point_angle + tau * (angle//tau)
+                if new_angle < angle:
+                    new_angle += tau
+                angle = new_angle
+            else:
+                angle += ANGLE_INC
+            angles[index] = angle
+        self.angle = angle
+
+        # Vectorised utils.convert_base() onto each unit direction
+        phases = angles % tau
+        cos, sin = np.cos(phases), np.sin(phases)
+        values = (cos*points.real + sin*points.imag) + 1j*(
+            sin*points.real - cos*points.imag
+        )
+
+        self._append(angles, values)
+        return angles, values
@@ -2,120 +2,221 @@
 Renders a path to the screen using pygame
 """
 
-from fourier import fourier_series, fourier_sum
-from camera import Camera, Circle, Line
-import extrapolate
-
-from functools import partial
-from itertools import islice, accumulate, count, tee
-
-import math
+from expansion import (
+    TABLE_PRECISION, TABLE_SAMPLES, add_coefficient_arguments,
+    coefficient_settings, gen_series_accumulation, gen_stepped_accumulation,
+    gen_table_accumulation, get_focal_points, is_series_file, load_series,
+    load_trajectory_table, path_coefficients, select_series, table_path
+)
+# Defined here before the expansion module, still importable from render
+from expansion import argand_transform, gen_radial_accumulation  # noqa: F401
+from camera import Camera, Polyline
+from instrument import FrameProfiler
+import path_file
+import cache
+
+import argparse
+import queue
+import threading
 import time
-import sys
-import pickle
 
-import pygame
+import numpy as np
 
 RENDER_RADIUS = 512
 
+# The number of accumulations computed ahead of the render loop
+PRODUCER_DEPTH = 8
+
+# The most points stored in a trail, and its number of intensity levels
+TRAIL_CAPACITY = 1024
+TRAIL_BANDS = 16
+
 
 def timer():
     start = time.time()
     return lambda: time.time()-start
 
 
-def argand_transform(t, z):
-    """Returns an argand point representing a complex polar coordinate at angle t
+def draw_chain(camera, accumulation, focus):
+    """Plots the pendulums representing the current fourier accumulation
+    Runs of pendulums too small to see are drawn as a single line
     """
-    return (
-        complex(
-            z.real * math.cos(t) + z.imag * math.sin(t),
-            z.real * math.sin(t) - z.imag * math.cos(t),
-        )
+    joints = camera.chain_joints(accumulation, keep=(focus, focus+1))
+    starts, ends = accumulation[joints[:-1]], accumulation[joints[1:]]
+    index = joints[:-1]
+
+    circle_colors = np.empty((len(starts), 4), dtype=np.uint8)
+    circle_colors[:] = (0, 50, 255, 0)
+    circle_colors[:, 3] = np.maximum(255-np.abs(index-focus)**2, 30)
+
+    line_colors = np.empty((len(starts), 4), dtype=np.uint8)
+    line_colors[:] = (255, 255, 255, 50)
+
+    focused = index == focus
+    circle_colors[focused] = (0, 255, 0, 255)
+    line_colors[focused] = (255, 255, 255, 255)
+
+    # Merged runs of pendulums have no circle
+    circles = (index != 0) & (np.diff(joints) == 1)
+    camera.add_circles(
+        circle_colors[circles], starts[circles],
+        np.abs(starts-ends)[circles]
     )
+    camera.add_lines(line_colors, starts, ends)
 
 
-def gen_draw_pendulum(lifetime=1):
-    """Returns a function that plots the array of pendulums and a point trail
+def gen_draw_trail(lifetime=1, clock=time.time, capacity=TRAIL_CAPACITY,
+                   bands=TRAIL_BANDS):
+    """Returns a function that records a point and plots the point trail
+    Points older than 'lifetime' seconds, measured by 'clock', are removed
+    If the camera is None the point is recorded without plotting.
+    The function returns the number of points in the trail
+
+    At most 'capacity' points are kept, once full the older half of the
+    trail is halved in detail. The trail is drawn in 'bands' intensities
     """
-    trail = []
+    if capacity < 4:
+        raise ValueError("A trail must store at least 4 points")
 
-    def draw_pendulum(camera, accumulation, focus):
-        """Plots the pendulums representing the current fourier accumulation
+    times = np.empty(capacity, dtype=np.float64)
+    points = np.empty(capacity, dtype=np.complex128)
+    start, length = 0, 0
+
+    def ordered():
+        """Returns the ring buffer indexes from oldest to newest
         """
-        for index, (p, c) in enumerate(zip(accumulation, accumulation[1:])):
-            circle_color = (0, 50, 255, max(255-abs(index-focus)**2, 30))
-            line_color = (255, 255, 255, 50)
+        return (start + np.arange(length)) % capacity
 
-            if index == focus:
-                circle_color = (0, 255, 0)
-                line_color = (255, 255, 255)
+    def record(current_t, point):
+        nonlocal start, length
 
-            if index != 0:
-                camera.add_shape(Circle(circle_color, p, abs(p-c)))
-            camera.add_shape(Line(line_color, p, c))
+        if length == capacity:
+            # Drop every other point in the older half of the trail
+            order = ordered()
+            keep = np.concatenate((order[:length//2:2], order[length//2:]))
+            times[:len(keep)], points[:len(keep)] = times[keep], points[keep]
+            start, length = 0, len(keep)
 
-        current_t = time.time()
-        trail.append((current_t, accumulation[-1]))
+        end = (start + length) % capacity
+        times[end], points[end] = current_t, point
+        length += 1
 
-        for i in range(len(trail))[::-1]:
-            if current_t - trail[i][0] > lifetime:
-                trail.pop(i)
+        while current_t - times[start] > lifetime:
+            start, length = (start + 1) % capacity, length - 1
 
-        for (created, p1), (_, p2) in zip(trail, trail[1:]):
-            intensity = 255 - int(255*(current_t-created) / lifetime)
-            camera.add_shape(Line((intensity, 0, 0), p1, p2), -created)
+    def draw_trail(camera, point):
+        current_t = clock()
+        record(current_t, point)
 
-    return draw_pendulum
+        if camera is None or length < 2:
+            return length
 
+        order = ordered()
+        created, trail = times[order], points[order]
 
-def gen_radial_accumulation(POINTS, n=1000):
-    """Calculates fourier coefficients and returns an expansion function
-    This generate a fourier accumulation at a given angle with 'n' terms
-    """
-    PERIOD = 2*math.pi * (max(POINTS)[0]//(2*math.pi) + 1)
+        # Group segments into bands of similar age and intensity
+        age = (current_t - created[:-1]) / lifetime
+        band = np.minimum((age*bands).astype(np.int64), bands-1)
+
+        # Each band is a run of consecutive segments, drawn as one polyline
+        runs = np.concatenate(([0], np.flatnonzero(np.diff(band)) + 1))
+        colors = [(255 - (255*level) // bands, 0, 0) for level in band[runs]]
+        camera.add_shape(Polyline(colors, trail, runs), -1)
+        return length
 
-    PATH = extrapolate.linear_extrapolater(POINTS)
+    return draw_trail
 
-    series = fourier_series(PATH, PERIOD)
-    terminating = list(islice(series, n))
 
-    def radial_accumulation(t):
-        return [0]+list(map(
-            partial(argand_transform, t),
-            accumulate(fourier_sum(terminating, t))
-        ))
+def gen_draw_pendulum(lifetime=1, clock=time.time, capacity=TRAIL_CAPACITY):
+    """Returns a function that plots the array of pendulums and a point trail
+    """
+    draw_trail = gen_draw_trail(lifetime, clock, capacity)
 
-    return radial_accumulation
+    def draw_pendulum(camera, accumulation, focus):
+        """Plots the pendulums representing the current fourier accumulation
+        Returns the number of points in the trail
+        """
+        draw_chain(camera, accumulation, focus)
+        return draw_trail(camera, accumulation[-1])
+
+    return draw_pendulum
 
 
-def get_focal_points(accumulation):
-    """Returns a list of coefficient indexes and their outer_radius.
-    These significantly contribute to the overall shape.
+class AccumulationProducer(threading.Thread):
+    """A thread that computes accumulations ahead of the render loop
+    Accumulations are queued in order as tuples (rotation, accumulation)
+    An exception raised by 'radial_accumulation' is raised again by get()
     """
-    global_radii = [0]+list(accumulate(
-        map(
-            lambda p: abs(p[0]-p[1]),
-            zip(accumulation, accumulation[1:])
-        )
-    ))
-
-    # A pair of iterators representing the radius of the expansion at each term
-    outer_radii = tee(map(
-        lambda radii: (global_radii[-1] - radii)/2,
-        global_radii
-    ))
-    # Skip the first term, so zip() can alternate values
-    next(outer_radii[1])
-
-    # Returns a list of the index and outer radius of each term
-    # Filter removes terms that dont make a significant contribution to radius
-    return list(
-        filter(
-            lambda val: val[1]*0.99 > val[2],
-            zip(count(), *outer_radii)
-        )
-    )
+    def __init__(self, radial_accumulation, depth=PRODUCER_DEPTH):
+        super().__init__(daemon=True)
+        self.radial_accumulation = radial_accumulation
+        self.queue = queue.Queue(depth)
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._rotation, self._step = 0, 0
+        self._running = True
+        self._error = None
+
+    def restart(self, rotation, step):
+        """Discards queued accumulations and continues from 'rotation'
+        Each following accumulation is 'step' further on
+        """
+        with self._lock:
+            self._generation += 1
+            self._rotation, self._step = rotation, step
+
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def stop(self):
+        self._running = False
+
+    def get(self):
+        """Returns the next tuple (rotation, accumulation)
+        Blocks until it has been computed
+        """
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                if self._error is not None:
+                    raise self._error
+                item = self.queue.get()
+
+            generation, rotation, accumulation = item
+            if generation == self._generation:
+                return rotation, accumulation
+
+    def _put(self, item, generation):
+        """Queues 'item' unless the producer is stopped or restarted first
+        """
+        while self._running:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if generation != self._generation:
+                    return
+
+    def run(self):
+        try:
+            while self._running:
+                with self._lock:
+                    generation = self._generation
+                    self._rotation += self._step
+                    rotation = self._rotation
+
+                accumulation = self.radial_accumulation(rotation)
+                self._put((generation, rotation, accumulation), generation)
+        except Exception as error:
+            # The error is set before the item that wakes get() is queued,
+            # so get() raises it even if restart() discards the item
+            self._error = error
+            self._put((None, None, None), None)
 
 
 def is_key_held(keys_down, key, hold_delay=0.2):
@@ -134,17 +235,51 @@ def update_focus(camera, focal_points, focus, direction):
     return focus
 
 
-def main(path):
+def main(path, fixed_step=None, pipelined=False, table=None, profiler=None,
+         overlay=False, series=None, **settings):
+    """Renders 'path' until the window is closed
+    If 'fixed_step' is set, time advances by exactly that many seconds per
+    frame, which allows the expansion to be advanced incrementally
+    If 'pipelined' is True, accumulations are computed ahead of time on a
+    separate thread. This implies a fixed step, of 1/60 by default
+    If 'table' is a tuple (path_name, samples, dtype), accumulations are
+    played back from a trajectory table saved next to the path file
+    If 'profiler' is an instrument.FrameProfiler, each stage of every frame
+    is timed. If 'overlay' is True the timings are drawn over the frame
+    If 'series' is a tuple (harmonics, coefficients, period), it is
+    rendered instead of computing the coefficients of 'path'
+    'settings' are passed to path_coefficients()
+    """
+    # Loaded here so the drawing functions can be used without a display
+    import pygame
+
+    if pipelined and fixed_step is None:
+        fixed_step = 1/60
+
     # Init
     pygame.init()
     screen = pygame.display.set_mode((RENDER_RADIUS*2, RENDER_RADIUS*2))
     camera = Camera(screen, RENDER_RADIUS, 2)
+    clock = pygame.time.Clock()
 
     draw_pendulum = gen_draw_pendulum(60)
-    radial_accumulation = gen_radial_accumulation(path)
+    if series is None:
+        series = path_coefficients(path, **settings)
+    if table is not None:
+        path_name, samples, dtype = table
+        radial_accumulation = gen_table_accumulation(
+            load_trajectory_table(
+                series, table_path(path_name, series), samples, dtype
+            ),
+            series[2]
+        )
+    elif fixed_step is not None:
+        radial_accumulation = gen_stepped_accumulation(*series)
+    else:
+        radial_accumulation = gen_series_accumulation(*series)
 
     # Gameloop
-    d_time = 1/60
+    d_time = fixed_step or 1/60
     running = True
     keys_down = {}
 
@@ -152,26 +287,56 @@ def main(path):
     focal_points = get_focal_points(radial_accumulation(0))
 
     rotation = 0
+    producer = None
+    if pipelined:
+        producer = AccumulationProducer(radial_accumulation)
+        producer.restart(rotation, d_time / ((focus+3)//2))
+        producer.start()
+
     while running:
         # Frame logic
         t = timer()
-        # Dilate time while zoomed in -- match rotation speed
-        rotation += d_time / ((focus+3)//2)
-        accumulation = radial_accumulation(rotation)
+        if profiler is not None:
+            profiler.begin_frame()
+        if producer is None:
+            # Dilate time while zoomed in -- match rotation speed
+            rotation += d_time / ((focus+3)//2)
+            accumulation = radial_accumulation(rotation)
+        else:
+            rotation, accumulation = producer.get()
+        if profiler is not None:
+            profiler.mark("accumulation")
 
         # Drawing
         screen.fill((0, 0, 0))
-        draw_pendulum(camera, accumulation, focal_points[focus][0])
+        trail_length = draw_pendulum(
+            camera, accumulation, focal_points[focus][0]
+        )
+        if profiler is not None:
+            profiler.mark("draw_pendulum")
 
         camera.center = accumulation[focal_points[focus][0]]
 
         camera.tick(d_time)
-        camera.flush()
+        shapes = camera.flush()
+        if profiler is not None:
+            profiler.mark("flush")
+            if overlay:
+                profiler.draw_overlay(screen)
+                profiler.mark("overlay")
+
         pygame.display.flip()
+        if profiler is not None:
+            profiler.mark("flip")
+            profiler.end_frame(shapes=shapes, trail=trail_length)
 
         # Timing
-        d_time = t()
+        if fixed_step is None:
+            d_time = t()
+        else:
+            clock.tick(1/fixed_step)
 
+        previous_focus = focus
         if is_key_held(keys_down, pygame.K_RIGHT, 0.2):
             keys_down[pygame.K_RIGHT] = time.time()-0.15
             focus = update_focus(camera, focal_points, focus, 1)
@@ -195,8 +360,92 @@ def main(path):
             if event.type == pygame.QUIT:
                 running = False
 
+        if producer is not None and focus != previous_focus:
+            # The time dilation has changed
+            producer.restart(rotation, d_time / ((focus+3)//2))
+
+    if producer is not None:
+        producer.stop()
+
 
 if __name__ == "__main__":
-    with open(sys.argv[1], 'rb') as file:
-        path = pickle.load(file)
-    main(path)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "path", help="a path file or saved coefficients (.npz)"
+    )
+    parser.add_argument(
+        "--fixed-step", type=float, metavar="SECONDS",
+        help="advance time by a constant step each frame, eg. 0.0166"
+    )
+    parser.add_argument(
+        "--pipelined", action="store_true",
+        help="compute frames ahead of time on a separate thread"
+    )
+    parser.add_argument(
+        "--table", action="store_true",
+        help="play back a precomputed trajectory table, saved by the path"
+    )
+    parser.add_argument(
+        "--table-samples", type=int, default=TABLE_SAMPLES, metavar="COUNT",
+        help=f"samples over one period of the table (default: {TABLE_SAMPLES})"
+    )
+    parser.add_argument(
+        "--table-precision", choices=TABLE_PRECISION, default="single",
+        help="the precision of the table (default: single)"
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="time each stage of every frame, printing percentiles on exit"
+    )
+    parser.add_argument(
+        "--overlay", action="store_true",
+        help="draw the frame timings over the render, implies --profile"
+    )
+    parser.add_argument(
+        "--trace", metavar="FILE",
+        help="save a Chrome trace of every frame to FILE, implies --profile"
+    )
+    add_coefficient_arguments(parser)
+    parser.add_argument(
+        "--clear-cache", action="store_true",
+        help="remove every cached coefficient before rendering"
+    )
+    path_file.add_legacy_argument(parser)
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        cache.clear()
+
+    # Saved coefficients skip the computation entirely
+    path, series = None, None
+    settings = coefficient_settings(args)
+    if is_series_file(args.path):
+        if args.exact:
+            parser.error("--exact cannot be used with saved coefficients")
+        series = select_series(
+            load_series(args.path), settings.get("n"), args.error,
+            args.energy, args.significant
+        )
+    else:
+        path = path_file.load_any(args.path, args.legacy_pickle)
+
+    table = None
+    if args.table:
+        table = (
+            args.path, args.table_samples,
+            TABLE_PRECISION[args.table_precision]
+        )
+
+    profiler = None
+    if args.profile or args.overlay or args.trace is not None:
+        profiler = FrameProfiler(trace=args.trace is not None)
+
+    main(
+        path, args.fixed_step, args.pipelined, table, profiler, args.overlay,
+        series, **settings
+    )
+
+    if profiler is not None:
+        print("\n".join(profiler.summary()))
+        if args.trace is not None:
+            profiler.write_trace(args.trace)
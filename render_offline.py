@@ -0,0 +1,235 @@
+"""
+Renders a path to image files or a video encoder without using a display
+Frames use a fixed timestep and are split between a pool of processes
+"""
+
+import render
+import expansion
+from camera import Camera
+import path_file
+
+from collections import deque
+from functools import partial
+from itertools import count
+
+import argparse
+import multiprocessing
+import subprocess
+import sys
+
+import numpy as np
+import pygame
+
+FRAME_RATE = 60
+TRAIL_LIFETIME = 60
+# The number of consecutive frames rendered by a process at once
+CHUNK_SIZE = 120
+# Raw video frames are held in memory until encoded, so chunks are smaller
+VIDEO_CHUNK_SIZE = 24
+# The most chunks queued or rendered per process, bounding memory use
+CHUNKS_IN_FLIGHT = 2
+
+# The state of each worker process, set by init_worker()
+worker = {}
+
+
+def init_worker(series, settings):
+    """Prepares a worker process to render frames of the series
+    'series' is a tuple of (harmonics, coefficients, period)
+    """
+    worker["radial_accumulation"] = expansion.gen_series_accumulation(*series)
+    worker["pen_tip"] = expansion.gen_series_tip(*series)
+    worker.update(settings)
+
+
+def trail_anchor(index, span):
+    """Returns the frame the trail is replayed from to draw frame 'index'
+    Frames within the same 'span' frames share an anchor at least 'span'
+    frames earlier. The trail decimates its older points, so this keeps
+    every frame independent of how the frames are split into chunks
+    """
+    return max(0, (index//span - 1)*span)
+
+
+def replay_trail(anchor, start):
+    """Returns a trail drawing function that has recorded the pen tip of
+    each frame from 'anchor' up to 'start'
+    Each call of the trail's clock advances by a single frame
+    """
+    fps, dilation = worker["fps"], worker["dilation"]
+    times = (index/fps for index in count(anchor))
+    draw_trail = render.gen_draw_trail(worker["lifetime"], partial(next, times))
+
+    # Only the pen tip is recorded, so the chain is not evaluated
+    indexes = np.arange(anchor, start)
+    for tip in worker["pen_tip"](indexes/fps/dilation).tolist():
+        draw_trail(None, tip)
+    return draw_trail
+
+
+def render_chunk(bounds):
+    """Renders the frames with indexes in the range 'bounds'
+    Returns a list of raw RGB frames, or None if the frames were saved
+    """
+    start, stop = bounds
+    radial_accumulation = worker["radial_accumulation"]
+    fps, lifetime = worker["fps"], worker["lifetime"]
+    term, dilation = worker["term"], worker["dilation"]
+    span = max(1, int(lifetime*fps))
+
+    surface = pygame.Surface((render.RENDER_RADIUS*2, render.RENDER_RADIUS*2))
+    camera = Camera(surface, render.RENDER_RADIUS, worker["radius"])
+
+    frames = []
+    anchor = None
+    for index in range(start, stop):
+        if trail_anchor(index, span) != anchor:
+            # Replay the trail left by earlier frames
+            anchor = trail_anchor(index, span)
+            draw_trail = replay_trail(anchor, index)
+
+        accumulation = radial_accumulation(index/fps/dilation)
+
+        surface.fill((0, 0, 0))
+        render.draw_chain(camera, accumulation, term)
+        draw_trail(camera, accumulation[-1])
+
+        camera.center = accumulation[term]
+        camera.flush()
+
+        if worker["pattern"] is None:
+            frames.append(pygame.image.tobytes(surface, "RGB"))
+        else:
+            pygame.image.save(surface, worker["pattern"] % index)
+
+    return frames if worker["pattern"] is None else None
+
+
+def encoder_command(encoder, output, fps):
+    """Returns the command line for an ffmpeg compatible encoder
+    The encoder reads raw RGB frames from stdin
+    """
+    size = render.RENDER_RADIUS*2
+    return [
+        encoder, "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24",
+        "-s", f"{size}x{size}", "-r", str(fps),
+        "-i", "-", output
+    ]
+
+
+def render_offline(points, frames, pattern=None, video=None,
+                   encoder="ffmpeg", focus=0, fps=FRAME_RATE,
+                   lifetime=TRAIL_LIFETIME, processes=None,
+                   chunk_size=None, **coefficient_settings):
+    """Renders 'frames' frames of the path 'points'
+    Frames are saved to the file names 'pattern % index', or are streamed
+    to 'encoder' which writes the video file 'video'.
+    'focus' is an index into the focal points, as used by render.main
+    Each process renders 'chunk_size' frames at a time, by default
+    VIDEO_CHUNK_SIZE for a video, otherwise CHUNK_SIZE
+    Other keyword arguments are passed to expansion.path_coefficients()
+    """
+    if (pattern is None) == (video is None):
+        raise ValueError("Exactly one of 'pattern' or 'video' is required")
+
+    series = expansion.path_coefficients(points, **coefficient_settings)
+
+    # Frame the camera as render.main does once the focus has settled
+    start = expansion.gen_series_accumulation(*series)(0)
+    focal_points = expansion.get_focal_points(start)
+    focus = max(0, min(focus, len(focal_points)-1))
+    settings = {
+        "fps": fps,
+        "lifetime": lifetime,
+        "pattern": pattern,
+        "term": focal_points[focus][0],
+        "radius": focal_points[focus][1] if focus else 2,
+        "dilation": (focus+3)//2,
+    }
+
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE if video is None else VIDEO_CHUNK_SIZE
+    chunks = [
+        (first, min(first+chunk_size, frames))
+        for first in range(0, frames, chunk_size)
+    ]
+
+    stream = None
+    if video is not None:
+        command = encoder_command(encoder, video, fps)
+        stream = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    processes = processes or multiprocessing.cpu_count()
+    done = 0
+    with multiprocessing.Pool(
+        processes, init_worker, (series, settings)
+    ) as pool:
+        # Only a few chunks are submitted ahead, so rendered frames cannot
+        # pile up in memory while the encoder catches up. Results are taken
+        # in order, as the encoder requires
+        pending = deque()
+
+        def collect():
+            nonlocal done
+            (first, last), result = pending.popleft()
+            rendered = result.get()
+            if stream is not None:
+                for frame in rendered:
+                    stream.stdin.write(frame)
+
+            done += last-first
+            print(f"Rendered {done}/{frames} frames", file=sys.stderr)
+
+        for chunk in chunks:
+            if len(pending) == processes*CHUNKS_IN_FLIGHT:
+                collect()
+            pending.append((chunk, pool.apply_async(render_chunk, (chunk,))))
+        while pending:
+            collect()
+
+    if stream is not None:
+        stream.stdin.close()
+        if stream.wait() != 0:
+            raise subprocess.CalledProcessError(stream.returncode, command)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="a path file")
+    parser.add_argument("frames", type=int, help="the number of frames")
+
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument(
+        "--frames-pattern", metavar="PATTERN",
+        help="save each frame as an image, eg. frames/%%05d.png"
+    )
+    output.add_argument(
+        "--video", metavar="FILE",
+        help="stream raw frames to the encoder, which writes FILE"
+    )
+
+    parser.add_argument(
+        "--encoder", default="ffmpeg",
+        help="an ffmpeg compatible encoder binary (default: ffmpeg)"
+    )
+    parser.add_argument("--fps", type=float, default=FRAME_RATE)
+    parser.add_argument("--lifetime", type=float, default=TRAIL_LIFETIME)
+    parser.add_argument("--focus", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument(
+        "--chunk-size", type=int, metavar="FRAMES",
+        help=f"frames rendered by a process at once (default: {CHUNK_SIZE}, "
+             f"or {VIDEO_CHUNK_SIZE} with --video)"
+    )
+    expansion.add_coefficient_arguments(parser)
+    path_file.add_legacy_argument(parser)
+    args = parser.parse_args()
+
+    path = path_file.load_any(args.path, args.legacy_pickle)
+
+    render_offline(
+        path, args.frames, args.frames_pattern, args.video, args.encoder,
+        args.focus, args.fps, args.lifetime, args.processes, args.chunk_size,
+        **expansion.coefficient_settings(args)
+    )
@@ -0,0 +1,120 @@
+"""
+Tools to reduce the number of points in a path
+Paths are compared by their value at each phase, as linear_extrapolater
+interpolates them
+"""
+
+import extrapolate
+import path_file
+
+import argparse
+import sys
+
+import numpy as np
+
+
+def segment_errors(angles, values, first, last):
+    """Returns the distance of each point between 'first' and 'last' from
+    the straight segment that joins them
+    """
+    inside = slice(first+1, last)
+    gradient = (values[last]-values[first]) / (angles[last]-angles[first])
+    expected = values[first] + gradient * (angles[inside]-angles[first])
+    return np.abs(values[inside] - expected)
+
+
+def simplify(points, tolerance):
+    """Returns a simplified pair of arrays (angles, values)
+    Points are removed while every removed point stays within 'tolerance'
+    of the simplified path (Ramer-Douglas-Peucker). The ends are kept
+    """
+    angles, values = extrapolate.path_arrays(points)
+    keep = np.zeros(len(angles), dtype=bool)
+    keep[[0, -1]] = True
+
+    segments = [(0, len(angles)-1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+
+        errors = segment_errors(angles, values, first, last)
+        furthest = int(np.argmax(errors))
+        if errors[furthest] > tolerance:
+            split = first + 1 + furthest
+            keep[split] = True
+            segments += [(first, split), (split, last)]
+
+    return angles[keep], values[keep]
+
+
+def resample(points, count):
+    """Returns a pair of arrays (angles, values) of 'count' points
+    The points are evenly spaced by arc length along the path's values
+    Raises a ValueError if 'count' is below 2 or the path has no length
+    """
+    if count < 2:
+        raise ValueError(f"Cannot resample a path to {count} points")
+
+    angles, values = extrapolate.path_arrays(points)
+    distance = np.concatenate(([0], np.cumsum(np.abs(np.diff(values)))))
+    if not distance[-1] > 0:
+        raise ValueError("Cannot resample a path of zero length")
+
+    targets = np.linspace(0, distance[-1], count)
+    new_angles = np.interp(targets, distance, angles)
+    new_values = np.interp(targets, distance, values.real) + 1j*np.interp(
+        targets, distance, values.imag
+    )
+    return new_angles, new_values
+
+
+def path_error(original, reduced):
+    """Returns the largest distance between a point of the 'original' path
+    and the 'reduced' path at the same phase
+    """
+    angles, values = extrapolate.path_arrays(original)
+    reduced_path = extrapolate.linear_extrapolater(reduced)
+    return float(np.max(np.abs(values - reduced_path(angles)), initial=0))
+
+
+def reduce_path(points, tolerance=None, count=None):
+    """Returns a pair of arrays (angles, values), resampled to 'count' points
+    and/or simplified within 'tolerance', then prints a summary
+    """
+    reduced = extrapolate.path_arrays(points)
+    if count is not None:
+        reduced = resample(reduced, count)
+    if tolerance is not None:
+        reduced = simplify(reduced, tolerance)
+
+    original = len(extrapolate.path_arrays(points)[0])
+    print(
+        f"Reduced path from {original} to {len(reduced[0])} points "
+        f"({original-len(reduced[0])} removed), "
+        f"largest error {path_error(points, reduced):.3g}",
+        file=sys.stderr
+    )
+    return reduced
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="a path file")
+    parser.add_argument("output", help="the path file to save")
+    parser.add_argument(
+        "--tolerance", type=float,
+        help="the largest distance a removed point may be from the path"
+    )
+    parser.add_argument(
+        "--resample", type=int, metavar="COUNT",
+        help="resample to COUNT points evenly spaced by arc length"
+    )
+    path_file.add_legacy_argument(parser)
+    args = parser.parse_args()
+
+    reduced = reduce_path(
+        path_file.load_any(args.path, args.legacy_pickle),
+        args.tolerance, args.resample
+    )
+    path_file.save(args.output, reduced)